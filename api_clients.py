@@ -1,87 +1,338 @@
 # api_clients.py
 
-from typing import Dict, Any
-from groq import Groq
+import inspect
+import socket
+import time
+from typing import Dict, Any, Callable, List, Optional, Tuple
+from groq import Groq, NOT_GIVEN
 from ollama import Client as OllamaClient
 from cerebras.cloud.sdk import Cerebras
+from cancellation import CancelToken, GenerationCancelled
+from metrics import metrics
+from profiling import profiler
 
-class GroqClientWrapper:
-    def __init__(self, api_key: str):
-        self.api_key = api_key
-        self.groq_client = Groq(api_key=api_key)
-    
-    def generate_response(self, context) -> str:
-        if not self.api_key:
-            raise ValueError("Groq API key not set.")
+def _abort(chunks):
+    """Close an SDK stream from another thread, waking the thread blocked reading it.
+
+    close() alone leaves a blocked read waiting for the server's next bytes,
+    so the socket under the response is shut down first.
+    """
+    response = getattr(chunks, 'response', None)
+    network = getattr(response, 'extensions', {}).get('network_stream')
+    sock = network.get_extra_info('socket') if network is not None else None
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    chunks.close()
+
+class _CallStats:
+    __slots__ = ("started", "first_token", "chunks", "usage")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.first_token = None
+        self.chunks = 0
+        self.usage = None
+
+class ChatClientWrapper:
+    """Shared request loop for the provider wrappers.
+
+    Subclasses open the upstream call and pull text out of its chunks; this
+    class handles streaming, cancellation and error reporting.
+    """
+    name = ""
+    error_prefix = ""
+
+    def generate_response(self, context, cancel_token: Optional[CancelToken] = None,
+                          on_chunk: Optional[Callable[[str], Any]] = None, stream: Optional[bool] = None) -> str:
+        """Return the assistant reply for the context's history.
+
+        `stream` overrides context.settings.stream. While streaming, each piece
+        of text is passed to `on_chunk`, and a cancelled `cancel_token` closes
+        the upstream stream and raises GenerationCancelled with the partial text.
+        """
+        self._check_ready()
+        stream = context.settings.stream if stream is None else stream
+        call = _CallStats() if metrics.enabled else None
         try:
-            chat_completion = self.groq_client.chat.completions.create(
-                messages=context.history,
-                model=context.model,
-                temperature=context.settings.temperature,
-                max_tokens=context.settings.max_tokens,
-                top_p=context.settings.top_p,
-                stream=context.settings.stream,
-                response_format=context.settings.response_format
-            )
-            if context.settings.stream:
-                response_text = ""
-                for chunk in chat_completion:
-                    content = chunk.choices[0].delta.content
-                    if content:
-                        response_text += content
-                        print(content, end='', flush=True)
-                print()
-                return response_text
+            if cancel_token is not None and cancel_token.cancelled:
+                raise GenerationCancelled("", 0, self.token_budget(context))
+            if stream:
+                with profiler.phase("request"):
+                    chunks = self._create(context, stream=True)
+                with profiler.phase("read"):
+                    text = self._consume(context, chunks, cancel_token, on_chunk, call)
             else:
-                return chat_completion.choices[0].message.content
+                with profiler.phase("request"):
+                    response = self._create(context, stream=False)
+                text = self._message_text(response)
+                if call:
+                    call.usage = self._usage(response)
+            if call:
+                self._record(context, call)
+            return text
+        except GenerationCancelled:
+            raise
         except Exception as e:
-            print(f"[DEBUG] Error calling Groq API: {e}")
-            return f"Groq Error: {e}"
+            if cancel_token is not None and cancel_token.cancelled:
+                # Closing the stream from another thread surfaces as a read error here.
+                raise GenerationCancelled("", 0, self.token_budget(context)) from e
+            if call:
+                self._record(context, call, error=type(e).__name__)
+            print(f"[DEBUG] {self.error_prefix}: {e}")
+            return f"{self.name} Error: {e}"
 
-class OllamaClientWrapper:
-    def __init__(self, host: str = 'http://localhost', port: int = 11434):
-        self.host = host
-        self.port = port
-        self.ollama_client = OllamaClient(host=f'{host}:{port}')
-    
-    def generate_response(self, context) -> str:
+    def generate_reply(self, context, messages: List[Any], tools: Optional[List[Dict[str, Any]]],
+                       cancel_token: Optional[CancelToken] = None) -> Tuple[str, List[Dict[str, str]]]:
+        """One round of a tool-calling turn: the reply text and the tool calls it asks for.
+
+        Sends `messages` instead of the context's history, offering `tools`, and
+        never streams. Tool calls come back as {"id", "name", "arguments"} with
+        the arguments as a JSON string.
+        """
+        self._check_ready()
+        call = _CallStats() if metrics.enabled else None
+        try:
+            if cancel_token is not None and cancel_token.cancelled:
+                raise GenerationCancelled("", 0, self.token_budget(context))
+            with profiler.phase("request"):
+                response = self._create(context, stream=False, messages=messages, tools=tools)
+            if call:
+                call.usage = self._usage(response)
+                self._record(context, call)
+            return self._message_text(response) or "", self._tool_calls(response)
+        except GenerationCancelled:
+            raise
+        except Exception as e:
+            if cancel_token is not None and cancel_token.cancelled:
+                raise GenerationCancelled("", 0, self.token_budget(context)) from e
+            if call:
+                self._record(context, call, error=type(e).__name__)
+            print(f"[DEBUG] {self.error_prefix}: {e}")
+            return f"{self.name} Error: {e}", []
+
+    def _record(self, context, call: _CallStats, error: Optional[str] = None):
+        labels = (context.service, context.model)
+        elapsed = time.perf_counter() - call.started
+        metrics.inc("llm_requests_total", *labels)
+        metrics.observe("llm_generation_seconds", elapsed, *labels)
+        if error:
+            metrics.inc("llm_errors_total", *labels, error)
+            return
+        # Without a streamed first token, the whole response arrived at once.
+        first_token = call.first_token if call.first_token is not None else elapsed
+        metrics.observe("llm_time_to_first_token_seconds", first_token, *labels)
+        prompt_tokens, completion_tokens = call.usage or (None, call.chunks or None)
+        if prompt_tokens is not None:
+            metrics.observe("llm_prompt_tokens", prompt_tokens, *labels)
+        if completion_tokens is not None:
+            metrics.observe("llm_completion_tokens", completion_tokens, *labels)
+            if elapsed > first_token:
+                metrics.observe("llm_tokens_per_second", completion_tokens / (elapsed - first_token), *labels)
+
+    def _consume(self, context, chunks, cancel_token: Optional[CancelToken], on_chunk,
+                 call: Optional[_CallStats] = None) -> str:
+        response_text = ""
+        received = 0
+        # SDK streams can be closed from the cancelling thread; generators only
+        # from the thread iterating them, so those are checked between chunks.
+        if cancel_token is not None and not inspect.isgenerator(chunks):
+            cancel_token.bind(lambda: _abort(chunks))
         try:
-            response_text = ""
-            if context.settings.stream:
-                for chunk in self.ollama_client.chat(
-                    model=context.model,
-                    messages=context.history,
-                    stream=True,
-                    options={
-                        "num_predict": context.settings.num_predict,
-                        "temperature": context.settings.temperature,
-                        "top_k": context.settings.top_k,
-                        "top_p": context.settings.top_p,
-                        "repeat_penalty": context.settings.repeat_penalty
-                    }
-                ):
-                    content = chunk['message']['content']
+            for chunk in chunks:
+                if cancel_token is not None and cancel_token.cancelled:
+                    break
+                content = self._chunk_text(chunk)
+                if call:
+                    call.usage = self._usage(chunk) or call.usage
+                if content:
+                    if call and call.first_token is None:
+                        call.first_token = time.perf_counter() - call.started
+                    received += 1
                     response_text += content
                     print(content, end='', flush=True)
-                print()
-            else:
-                response = self.ollama_client.chat(
-                    model=context.model,
-                    messages=context.history,
-                    options={
-                        "num_predict": context.settings.num_predict,
-                        "temperature": context.settings.temperature,
-                        "top_k": context.settings.top_k,
-                        "top_p": context.settings.top_p,
-                        "repeat_penalty": context.settings.repeat_penalty
-                    }
-                )
-                response_text = response['message']['content']
-            return response_text
-        except Exception as e:
-            print(f"[DEBUG] Ollama Error: {e}")
-            return f"Ollama Error: {e}"
-    
+                    if on_chunk:
+                        on_chunk(content)
+        except Exception:
+            if not (cancel_token is not None and cancel_token.cancelled):
+                raise
+        finally:
+            print()
+            if hasattr(chunks, 'close'):
+                chunks.close()
+        if cancel_token is not None and cancel_token.cancelled:
+            # Each streamed chunk carries about one token.
+            raise GenerationCancelled(response_text, received, max(0, self.token_budget(context) - received))
+        if call:
+            call.chunks = received
+        return response_text
+
+    def token_budget(self, context) -> int:
+        return max(0, getattr(context.settings, 'max_tokens', 0) or 0)
+
+    def _usage(self, response) -> Optional[Tuple[int, int]]:
+        # OpenAI-style usage; Groq reports it on the last stream chunk under x_groq.
+        usage = getattr(response, 'usage', None) or getattr(getattr(response, 'x_groq', None), 'usage', None)
+        if usage is None:
+            return None
+        return usage.prompt_tokens, usage.completion_tokens
+
+    def _check_ready(self):
+        pass
+
+    def _create(self, context, stream: bool, messages: Optional[List[Any]] = None,
+                tools: Optional[List[Dict[str, Any]]] = None):
+        raise NotImplementedError
+
+    def _chunk_text(self, chunk) -> str:
+        raise NotImplementedError
+
+    def _message_text(self, response) -> str:
+        raise NotImplementedError
+
+    def _tool_calls(self, response) -> List[Dict[str, str]]:
+        # OpenAI-style tool calls, as returned by Groq and Cerebras
+        calls = response.choices[0].message.tool_calls or []
+        return [{"id": call.id, "name": call.function.name, "arguments": call.function.arguments}
+                for call in calls]
+
+class GroqClientWrapper(ChatClientWrapper):
+    name = "Groq"
+    error_prefix = "Error calling Groq API"
+
+    def __init__(self, api_key: str, base_url: Optional[str] = None):
+        self.api_key = api_key
+        self.groq_client = Groq(api_key=api_key, base_url=base_url)
+
+    def _check_ready(self):
+        if not self.api_key:
+            raise ValueError("Groq API key not set.")
+
+    def _create(self, context, stream: bool, messages: Optional[List[Any]] = None,
+                tools: Optional[List[Dict[str, Any]]] = None):
+        return self.groq_client.chat.completions.create(
+            messages=context.history if messages is None else messages,
+            model=context.model,
+            temperature=context.settings.temperature,
+            max_tokens=context.settings.max_tokens,
+            top_p=context.settings.top_p,
+            stream=stream,
+            response_format=context.settings.response_format,
+            tools=tools or NOT_GIVEN
+        )
+
+    def _chunk_text(self, chunk) -> str:
+        return chunk.choices[0].delta.content if chunk.choices else None
+
+    def _message_text(self, response) -> str:
+        return response.choices[0].message.content
+
+class OllamaClientWrapper(ChatClientWrapper):
+    name = "Ollama"
+    error_prefix = "Ollama Error"
+    # Once a history outgrows num_ctx, older turns are dropped about this share of it at a time
+    WINDOW_DROP = 0.25
+
+    def __init__(self, host: str = 'http://localhost', port: int = 11434,
+                 keep_alive: Optional[Dict[str, Any]] = None):
+        self.host = host
+        self.port = port
+        self.ollama_client = OllamaClient(host=f'{host}:{port}')
+        # keep_alive per model; the "" entry covers models without their own
+        self.keep_alive = keep_alive or {}
+
+    def keep_alive_for(self, model: str, settings=None):
+        """How long Ollama keeps the model loaded after a request; None leaves Ollama's default."""
+        override = getattr(settings, 'keep_alive', None)
+        if override is not None:
+            return override
+        return self.keep_alive.get(model, self.keep_alive.get(''))
+
+    def preload(self, models: List[str]):
+        """Load models ahead of their first turn, so it does not pay the cold load."""
+        for model in models:
+            started = time.perf_counter()
+            try:
+                # A chat request without messages only loads the model
+                self.ollama_client.chat(model=model, messages=[], keep_alive=self.keep_alive_for(model))
+                print(f"[Info] Preloaded Ollama model {model} in {time.perf_counter() - started:.1f}s.")
+            except Exception as e:
+                print(f"[DEBUG] Ollama Error when preloading {model}: {e}")
+
+    def window(self, context) -> List[Any]:
+        """The part of the history to send, so that consecutive turns share a prompt prefix.
+
+        Ollama reuses its cache for the longest prefix a prompt shares with the
+        previous one. Left to fit a long history into num_ctx by itself, it
+        drops the oldest messages on every turn, and no two turns share more
+        than the system prompt. Here the leading system messages are always
+        sent, and the rest starts at a user message on a fixed grid, every
+        WINDOW_DROP of the budget in tokens. The history only grows, so the
+        grid never moves and the start only jumps every few turns.
+
+        Only done when the context sets num_ctx; without it the server's own
+        context size is unknown here, so the whole history is sent.
+        """
+        history = context.history
+        num_ctx = getattr(context.settings, 'num_ctx', None)
+        if not num_ctx:
+            return history
+        num_predict = context.settings.num_predict
+        budget = num_ctx - (num_predict if num_predict and num_predict > 0 else num_ctx // 4)
+        sizes = [_estimate_tokens(message["content"]) for message in history]
+        total = sum(sizes)
+        pinned = 0
+        while pinned < len(history) and history[pinned]["role"] == "system":
+            pinned += 1
+        step = max(1, int(budget * self.WINDOW_DROP))
+        start, dropped, boundary = pinned, 0, 0
+        last = len(history) - 1
+        while total > budget and start < last:
+            boundary += step
+            while start < last and (dropped < boundary or history[start]["role"] != "user"):
+                dropped += sizes[start]
+                total -= sizes[start]
+                start += 1
+        return history if start == pinned else history[:pinned] + history[start:]
+
+    def _create(self, context, stream: bool, messages: Optional[List[Any]] = None,
+                tools: Optional[List[Dict[str, Any]]] = None):
+        options = {
+            "num_predict": context.settings.num_predict,
+            "temperature": context.settings.temperature,
+            "top_k": context.settings.top_k,
+            "top_p": context.settings.top_p,
+            "repeat_penalty": context.settings.repeat_penalty
+        }
+        num_ctx = getattr(context.settings, 'num_ctx', None)
+        if num_ctx:
+            options["num_ctx"] = num_ctx
+        return self.ollama_client.chat(
+            model=context.model,
+            messages=self.window(context) if messages is None else messages,
+            stream=stream,
+            options=options,
+            keep_alive=self.keep_alive_for(context.model, context.settings)
+        )
+
+    def _chunk_text(self, chunk) -> str:
+        return chunk['message']['content']
+
+    def _message_text(self, response) -> str:
+        return response['message']['content']
+
+    def _usage(self, response) -> Optional[Tuple[int, int]]:
+        completion_tokens = getattr(response, 'eval_count', None)
+        if completion_tokens is None:
+            return None
+        return getattr(response, 'prompt_eval_count', None) or 0, completion_tokens
+
+    def token_budget(self, context) -> int:
+        # num_predict of -1 means "until done", so nothing can be counted as saved
+        return max(0, context.settings.num_predict or 0)
+
     def list_models(self) -> Dict[str, Any]:
         try:
             return self.ollama_client.list()
@@ -89,43 +340,44 @@ class OllamaClientWrapper:
             print(f"[DEBUG] Ollama Error when listing models: {e}")
             return {}
 
-class CerebrasClientWrapper:
-    def __init__(self, api_key: str):
+def _estimate_tokens(text: str) -> int:
+    # Errs high (about 3 characters a token) so a window never overflows num_ctx
+    return len(text) // 3 + 4
+
+class CerebrasClientWrapper(ChatClientWrapper):
+    name = "Cerebras"
+    error_prefix = "Error calling Cerebras API"
+
+    def __init__(self, api_key: str, base_url: Optional[str] = None):
         self.api_key = api_key
-        self.cerebras_client = Cerebras(api_key=api_key)
-    
-    def generate_response(self, context) -> str:
+        self.cerebras_client = Cerebras(api_key=api_key, base_url=base_url)
+
+    def _check_ready(self):
         if not self.api_key:
             raise ValueError("Cerebras API key not set.")
-        try:
-            response = self.cerebras_client.chat.completions.create(
-                messages=context.history,
-                model=context.model,
-                temperature=context.settings.temperature,
-                max_tokens=context.settings.max_tokens,
-                top_p=context.settings.top_p,
-                stream=context.settings.stream,
-                tools=context.settings.tools if context.settings.use_tools else None
-            )
-            if context.settings.stream:
-                response_text = ""
-                for chunk in response:
-                    content = chunk.choices[0].delta.content
-                    if content:
-                        response_text += content
-                        print(content, end='', flush=True)
-                print()
-                return response_text
-            else:
-                return response.choices[0].message.content
-        except Exception as e:
-            print(f"[DEBUG] Error calling Cerebras API: {e}")
-            return f"Cerebras Error: {e}"
-    
+
+    def _create(self, context, stream: bool, messages: Optional[List[Any]] = None,
+                tools: Optional[List[Dict[str, Any]]] = None):
+        return self.cerebras_client.chat.completions.create(
+            messages=context.history if messages is None else messages,
+            model=context.model,
+            temperature=context.settings.temperature,
+            max_tokens=context.settings.max_tokens,
+            top_p=context.settings.top_p,
+            stream=stream,
+            tools=tools
+        )
+
+    def _chunk_text(self, chunk) -> str:
+        return chunk.choices[0].delta.content if chunk.choices else None
+
+    def _message_text(self, response) -> str:
+        return response.choices[0].message.content
+
     def list_models(self) -> list:
         try:
             models = self.cerebras_client.models.list()
             return [model.id for model in models.data]
         except Exception as e:
             print(f"[DEBUG] Cerebras Error when listing models: {e}")
-            return []
\ No newline at end of file
+            return []
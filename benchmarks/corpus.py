@@ -0,0 +1,51 @@
+# benchmarks/corpus.py
+#
+# Synthetic game sessions shaped like the ones game_logic produces.
+
+import json
+import random
+from typing import Any, Dict, List
+
+# Same size as the isekai game prompt used by game_logic.initialize_game (~2 KB).
+SYSTEM_PROMPT = "You are the game logic for an isekai anime-themed text-based adventure. " * 28
+INITIAL_PROMPT = "Start a new isekai anime-themed adventure game. Describe the opening scene where the player is transported to a fantasy world."
+USER_TURN = "I walk up to the guild receptionist and ask about beginner quests."
+ASSISTANT_TURN = json.dumps({
+    "narration": "The receptionist smiles and slides a parchment across the counter. " * 6,
+    "image": {"top": "A new quest!", "bottom": "Rank F: Herb gathering", "prompt": "anime guild hall, warm light " * 4},
+    "actions": [{"description": f"Option {i}"} for i in range(1, 5)],
+})
+
+
+def game_session(name: str, turns: int, service: str = "groq", model: str = "llama-3.1-8b-instant") -> Dict[str, Any]:
+    """A context record as ConversationContext.to_dict returns it after `turns` game turns."""
+    history = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": INITIAL_PROMPT},
+        {"role": "assistant", "content": f"{ASSISTANT_TURN} ({name}/0)"},
+    ]
+    for turn in range(1, turns + 1):
+        history.append({"role": "user", "content": f"{USER_TURN} ({turn})"})
+        history.append({"role": "assistant", "content": f"{ASSISTANT_TURN} ({name}/{turn})"})
+    return {
+        "name": name,
+        "service": service,
+        "model": model,
+        "system_prompt": SYSTEM_PROMPT,
+        "settings": {},
+        "history": history,
+    }
+
+
+def game_corpus(num_sessions: int, max_turns: int = 20, copy_ratio: float = 0.2, seed: int = 0) -> List[Dict[str, Any]]:
+    """Game sessions where `copy_ratio` of them are copy_context copies of an earlier one."""
+    rng = random.Random(seed)
+    records = []
+    for i in range(num_sessions):
+        if records and rng.random() < copy_ratio:
+            source = rng.choice(records)
+            records.append(dict(source, name=f"game-{i}", history=list(source["history"])))
+        else:
+            records.append(game_session(f"game-{i}", rng.randint(0, max_turns)))
+    return records
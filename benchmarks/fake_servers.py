@@ -0,0 +1,300 @@
+# benchmarks/fake_servers.py
+#
+# In-process stand-ins for the provider APIs, so the server can be exercised
+# without API keys or an Ollama box:
+#   - OpenAI-style chat completions, as used by Groq (/openai/v1/chat/completions)
+#     and Cerebras (/v1/chat/completions), streamed as server-sent events
+#   - Ollama's /api/chat, streamed as NDJSON, and /api/tags
+#
+# Usage:
+#   with FakeProviderServer("openai", latency=0.2, tokens_per_second=200) as server:
+#       manager = ConversationManager(groq_api_key="fake", groq_base_url=server.url, ...)
+
+import json
+import random
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+DEFAULT_REPLY = json.dumps({
+    "narration": "You wake in a meadow under two moons. A guild banner flaps over a distant town.",
+    "image": {"top": "Another world?!", "bottom": "The adventure begins", "prompt": "anime meadow, two moons, fantasy town"},
+    "actions": [{"description": "Walk to the town"}, {"description": "Inspect your pockets"},
+                {"description": "Call out for help"}, {"description": "Lie back down"}],
+})
+
+
+class FakeProviderServer:
+    """A threaded HTTP server that answers chat requests with a canned reply.
+
+    latency            seconds before the first token (or the whole non-streamed reply)
+    tail_rate          fraction of requests that wait `tail_latency` seconds instead
+    tokens_per_second  pace of the streamed tokens; None streams them as fast as possible
+    tokens             how many pieces the reply is split into
+    error_rate         fraction of requests answered with `error_status`
+    tool_calls         ({"name": ..., "arguments": {...}}, ...) asked for when a request
+                       offers tools and has no tool results yet (openai kind only)
+
+    The ollama kind also models a local server's model memory:
+    load_latency       seconds to load a model that is not loaded; a model stays
+                       loaded for the request's keep_alive (5 minutes by default)
+    prefill_tokens_per_second
+                       pace of prompt processing for the part of the prompt that is
+                       not a prefix of the model's previous prompt and reply. Prompts
+                       over num_ctx lose their oldest messages first, as in Ollama.
+    """
+
+    def __init__(self, kind: str = "openai", latency: float = 0.0, tokens_per_second: Optional[float] = None,
+                 tokens: int = 64, error_rate: float = 0.0, error_status: int = 500, reply: str = DEFAULT_REPLY,
+                 host: str = "127.0.0.1", port: int = 0, seed: int = 0,
+                 tool_calls: Optional[List[Dict[str, Any]]] = None, load_latency: float = 0.0,
+                 prefill_tokens_per_second: Optional[float] = None, tail_rate: float = 0.0,
+                 tail_latency: float = 0.0):
+        if kind not in ("openai", "ollama"):
+            raise ValueError(f"Unknown fake server kind: {kind}")
+        self.kind = kind
+        self.latency = latency
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self.tokens_per_second = tokens_per_second
+        self.tokens = tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.reply = reply
+        self.tool_calls = tool_calls or []
+        self.load_latency = load_latency
+        self.prefill_tokens_per_second = prefill_tokens_per_second
+        self.loads = 0
+        self._loaded: Dict[str, float] = {}
+        self._cached: Dict[str, list] = {}
+        self.requests = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'FakeProviderServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> 'FakeProviderServer':
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def pieces(self):
+        size = max(1, len(self.reply) // max(1, self.tokens))
+        return [self.reply[i:i + size] for i in range(0, len(self.reply), size)]
+
+    def _prefill(self, model: str, messages: list, options: dict, keep_alive) -> Tuple[float, int]:
+        """Seconds spent loading the model and processing the uncached prompt, and that prompt's tokens."""
+        now = time.monotonic()
+        delay = 0.0
+        with self._lock:
+            if self._loaded.get(model, 0.0) <= now:
+                delay += self.load_latency
+                self.loads += 1
+                self._cached.pop(model, None)
+            self._loaded[model] = now + delay + _keep_alive_seconds(keep_alive)
+            if not messages:
+                return delay, 0
+            prompt = _truncate([(m.get("role"), str(m.get("content", ""))) for m in messages],
+                               options.get("num_ctx") or 4096)
+            cached = self._cached.get(model, [])
+            shared = 0
+            for i, message in enumerate(prompt):
+                if i >= len(cached) or cached[i] != message:
+                    break
+                shared += _tokens(message)
+            # The reply is in the cache too, so the next turn can reuse it
+            self._cached[model] = prompt + [("assistant", self.reply)]
+        uncached = sum(map(_tokens, prompt)) - shared
+        if self.prefill_tokens_per_second:
+            delay += uncached / self.prefill_tokens_per_second
+        return delay, uncached
+
+    def _latency(self) -> float:
+        with self._lock:
+            return self.tail_latency if self.tail_rate > 0 and self._rng.random() < self.tail_rate else self.latency
+
+    def _should_fail(self) -> bool:
+        with self._lock:
+            self.requests += 1
+            return self.error_rate > 0 and self._rng.random() < self.error_rate
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                # Headers and body go out as separate writes; without this, Nagle's
+                # algorithm and delayed ACKs add ~40 ms to every response.
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.endswith("/models"):
+                    self._json({"object": "list", "data": [{"id": "fake-model", "object": "model", "created": 0, "owned_by": "fake"}]})
+                elif self.path == "/api/tags":
+                    self._json({"models": [{"name": "fake-model", "model": "fake-model"}]})
+                else:
+                    self._json({"error": "not found"}, status=404)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if fake._should_fail():
+                    self._json({"error": {"message": "injected failure", "type": "server_error"}}, status=fake.error_status)
+                    return
+                latency = fake._latency()
+                if fake.kind == "openai" and self.path.endswith("/chat/completions"):
+                    self._openai(body, latency)
+                    return
+                time.sleep(latency)
+                if fake.kind == "ollama" and self.path == "/api/chat":
+                    self._ollama(body)
+                else:
+                    self._json({"error": "not found"}, status=404)
+
+            def _json(self, payload, status: int = 200):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _stream(self, content_type: str, events):
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                try:
+                    for event in events:
+                        self.wfile.write(f"{len(event):x}\r\n".encode() + event + b"\r\n")
+                        self.wfile.flush()
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client hung up, e.g. because the request was cancelled.
+                    self.close_connection = True
+
+            def _paced(self, pieces):
+                for i, piece in enumerate(pieces):
+                    if i and fake.tokens_per_second:
+                        time.sleep(1 / fake.tokens_per_second)
+                    yield piece
+
+            def _openai(self, body, latency: float):
+                # Like the real APIs, a stream's headers go out at once and the
+                # latency is spent before its first token
+                if not body.get("stream"):
+                    time.sleep(latency)
+                model = body.get("model", "fake-model")
+                prompt_tokens = sum(len(str(m.get("content", ""))) // 4 for m in body.get("messages", []))
+                pieces = fake.pieces()
+                usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(pieces),
+                         "total_tokens": prompt_tokens + len(pieces)}
+                if fake.tool_calls and body.get("tools") and \
+                        not any(m.get("role") == "tool" for m in body.get("messages", [])):
+                    calls = [{"id": f"call_{i}", "type": "function",
+                              "function": {"name": c["name"], "arguments": json.dumps(c["arguments"])}}
+                             for i, c in enumerate(fake.tool_calls)]
+                    self._json({
+                        "id": "fake", "object": "chat.completion", "created": int(time.time()), "model": model,
+                        "system_fingerprint": "fake",
+                        "choices": [{"index": 0, "finish_reason": "tool_calls",
+                                     "message": {"role": "assistant", "content": None, "tool_calls": calls}}],
+                        "usage": usage,
+                    })
+                    return
+                if not body.get("stream"):
+                    self._json({
+                        "id": "fake", "object": "chat.completion", "created": int(time.time()), "model": model,
+                        "system_fingerprint": "fake",
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": fake.reply}}],
+                        "usage": usage,
+                    })
+                    return
+
+                def events():
+                    base = {"id": "fake", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                            "system_fingerprint": "fake"}
+                    time.sleep(latency)
+                    for piece in self._paced(pieces):
+                        chunk = dict(base, choices=[{"index": 0, "delta": {"content": piece}, "finish_reason": None}])
+                        yield f"data: {json.dumps(chunk)}\n\n".encode()
+                    last = dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                                usage=usage, x_groq={"id": "fake", "usage": usage})
+                    yield f"data: {json.dumps(last)}\n\n".encode()
+                    yield b"data: [DONE]\n\n"
+
+                self._stream("text/event-stream", events())
+
+            def _ollama(self, body):
+                model = body.get("model", "fake-model")
+                messages = body.get("messages") or []
+                delay, prompt_tokens = fake._prefill(model, messages, body.get("options") or {}, body.get("keep_alive"))
+                time.sleep(delay)
+                if not messages:
+                    self._json({"model": model, "created_at": "2024-01-01T00:00:00Z", "done": True,
+                                "done_reason": "load", "message": {"role": "assistant", "content": ""}})
+                    return
+                pieces = fake.pieces()
+                done = {"model": model, "created_at": "2024-01-01T00:00:00Z", "done": True, "done_reason": "stop",
+                        "prompt_eval_count": prompt_tokens, "eval_count": len(pieces)}
+                if not body.get("stream", True):
+                    self._json(dict(done, message={"role": "assistant", "content": fake.reply}))
+                    return
+
+                def events():
+                    for piece in self._paced(pieces):
+                        yield (json.dumps({"model": model, "created_at": "2024-01-01T00:00:00Z", "done": False,
+                                           "message": {"role": "assistant", "content": piece}}) + "\n").encode()
+                    yield (json.dumps(dict(done, message={"role": "assistant", "content": ""})) + "\n").encode()
+
+                self._stream("application/x-ndjson", events())
+
+        return Handler
+
+def _tokens(message: Tuple[str, str]) -> int:
+    return len(message[1]) // 4 + 4
+
+def _truncate(prompt: list, num_ctx: int) -> list:
+    # Like Ollama: keep the system messages and drop the oldest others until the prompt fits
+    system = [m for m in prompt if m[0] == "system"]
+    rest = [m for m in prompt if m[0] != "system"]
+    used = sum(map(_tokens, system))
+    total = used + sum(map(_tokens, rest))
+    start = 0
+    while total > num_ctx and start < len(rest) - 1:
+        total -= _tokens(rest[start])
+        start += 1
+    return system + rest[start:]
+
+def _keep_alive_seconds(value) -> float:
+    if value is None:
+        return 300.0
+    if isinstance(value, str):
+        units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+        unit = next((u for u in ("ms", "s", "m", "h") if value.endswith(u)), "")
+        value = float(value[:len(value) - len(unit)]) * units.get(unit, 1)
+    return float("inf") if value < 0 else float(value)
@@ -0,0 +1,118 @@
+# benchmarks/hedged_requests.py
+#
+# Tail latency with and without hedged requests. Two fake OpenAI-style
+# providers stand in for Groq (primary) and Cerebras (backup); each has an
+# occasional multi-second stall. The same turns are run unhedged and hedged
+# and the time to first token and total time are compared.
+# Run from the repository root:
+#   python -m benchmarks.hedged_requests --requests 400
+#   python -m benchmarks.hedged_requests --tail-rate 0.05 --tail-latency 3 --concurrency 4
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+from benchmarks.corpus import SYSTEM_PROMPT, USER_TURN
+from benchmarks.fake_servers import FakeProviderServer
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+
+    def at(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 1)
+
+    return {"p50_ms": at(0.50), "p95_ms": at(0.95), "p99_ms": at(0.99), "max_ms": round(ordered[-1] * 1000, 1)}
+
+
+def run_mode(hedge: bool, args, tmp: str) -> Dict[str, Any]:
+    from conversation_manager import ConversationContext, ConversationManager
+    from hedging import Hedger
+    from messages import Message
+
+    fake = dict(latency=args.latency, tail_rate=args.tail_rate, tail_latency=args.tail_latency,
+                tokens_per_second=args.tokens_per_second, tokens=args.tokens)
+    with FakeProviderServer("openai", seed=1, **fake) as primary, FakeProviderServer("openai", seed=2, **fake) as backup:
+        manager = ConversationManager(groq_api_key="fake", groq_base_url=primary.url,
+                                      cerebras_api_key="fake", cerebras_base_url=backup.url,
+                                      db_path=os.path.join(tmp, f"hedge-{hedge}.json"),
+                                      hedger=Hedger(quantile=args.quantile, max_rate=args.max_rate))
+        manager.autosave_enabled = False
+        for i in range(args.concurrency):
+            manager.create_context(f"c{i}", "groq", "fake-groq", SYSTEM_PROMPT, {"stream": True},
+                                   hedge={"service": "cerebras", "model": "fake-cerebras"} if hedge else None)
+
+        first_token, total = [], []
+        lock = threading.Lock()
+
+        def turn(i: int):
+            base = manager.get_context(f"c{i % args.concurrency}")
+            # Turns are not kept, so every request carries a history of the same size
+            context = ConversationContext(base.name, base.service, base.model, base.system_prompt, base.settings,
+                                          history=base.history + [Message("user", f"{USER_TURN} ({i})")],
+                                          hedge=base.hedge)
+            first: List[float] = []
+            started = time.perf_counter()
+            manager.generate(context, on_chunk=lambda text: first or first.append(time.perf_counter()), stream=True)
+            finished = time.perf_counter()
+            with lock:
+                first_token.append((first[0] if first else finished) - started)
+                total.append(finished - started)
+
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(turn, range(args.requests)))
+
+        result = {"hedged": hedge, "requests": args.requests,
+                  "first_token": percentiles(first_token), "total": percentiles(total),
+                  "upstream_requests": {"primary": primary.requests, "backup": backup.requests}}
+        if hedge:
+            result["hedger"] = manager.hedger.stats()
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare tail latency with and without hedged requests")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.05, help="Usual time to first token")
+    parser.add_argument("--tail-rate", type=float, default=0.03, help="Fraction of requests that stall")
+    parser.add_argument("--tail-latency", type=float, default=2.0, help="Seconds a stalled request waits")
+    parser.add_argument("--tokens-per-second", type=float, default=500.0)
+    parser.add_argument("--tokens", type=int, default=32)
+    parser.add_argument("--quantile", type=float, default=0.95, help="Hedge threshold quantile")
+    parser.add_argument("--max-rate", type=float, default=0.2, help="Largest share of requests hedged")
+    parser.add_argument("--output", type=str, help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # The wrappers echo streamed tokens to stdout; keep them out of the report.
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            unhedged = run_mode(False, args, tmp)
+            hedged = run_mode(True, args, tmp)
+
+    before, after = unhedged["first_token"]["p99_ms"], hedged["first_token"]["p99_ms"]
+    stats = next(iter(hedged["hedger"].values()))
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": sys.version.split()[0],
+        "settings": vars(args),
+        "hedge_rate": stats["hedge_rate"],
+        "backup_wins": stats["backup_wins"],
+        "first_token_p99_improvement": round(1 - after / before, 3) if before else None,
+        "results": [unhedged, hedged],
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
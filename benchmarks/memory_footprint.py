@@ -0,0 +1,71 @@
+# benchmarks/memory_footprint.py
+#
+# Measures the resident cost of loaded contexts with tracemalloc.
+# Run from the repository root: python -m benchmarks.memory_footprint
+
+import argparse
+import json
+import tracemalloc
+
+from conversation_manager import ConversationContext
+from benchmarks.corpus import ASSISTANT_TURN, SYSTEM_PROMPT, USER_TURN
+
+
+def build_records(num_contexts: int, turns: int) -> str:
+    records = []
+    for i in range(num_contexts):
+        history = [{"role": "system", "content": SYSTEM_PROMPT}]
+        for turn in range(turns):
+            history.append({"role": "user", "content": f"{USER_TURN} ({turn})"})
+            history.append({"role": "assistant", "content": f"{ASSISTANT_TURN} ({i}/{turn})"})
+        records.append({
+            "name": f"game-{i}",
+            "service": "groq",
+            "model": "llama-3.1-8b-instant",
+            "system_prompt": SYSTEM_PROMPT,
+            "settings": {},
+            "history": history,
+        })
+    return json.dumps(records)
+
+
+def measure(num_contexts: int, turns: int) -> dict:
+    # Contexts are decoded from JSON, as load_all_contexts_from_db does, and
+    # only what they keep alive after the decoded records are dropped counts.
+    payload = build_records(num_contexts, turns)
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    records = json.loads(payload)
+    contexts = [ConversationContext.from_dict(record) for record in records]
+    del records
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    total = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    messages = sum(len(ctx.history) for ctx in contexts)
+    return {
+        "contexts": num_contexts,
+        "turns": turns,
+        "messages": messages,
+        "total_bytes": total,
+        "bytes_per_context": round(total / num_contexts),
+        "bytes_per_message": round(total / messages),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure in-memory size of conversation contexts")
+    parser.add_argument("--contexts", type=int, default=2000)
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--output", type=str, help="Write the result as JSON to this file")
+    args = parser.parse_args()
+
+    result = measure(args.contexts, args.turns)
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+# benchmarks/ollama_session.py
+#
+# Time to first token over a long Ollama game session, turn by turn. Shows
+# whether each turn reuses the prompt cache of the turn before it, and what
+# cold model loads cost. Against the fake Ollama server by default, which
+# models loading and prompt caching; pass --ollama-url to use a real one.
+# Run from the repository root:
+#   python -m benchmarks.ollama_session --turns 80 --window-drops 0 0.25
+#   python -m benchmarks.ollama_session --keep-alive 0 --idle 1 --preload
+#
+# --window-drops 0 drops the oldest messages on every turn once the history
+# outgrows num_ctx, which is what Ollama does when left to truncate itself.
+
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from benchmarks.corpus import SYSTEM_PROMPT, USER_TURN
+from benchmarks.fake_servers import FakeProviderServer
+
+
+def percentile(samples: List[float], q: float) -> float:
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 3)
+
+
+def keep_alive(value: str):
+    # As in manager_instance: seconds, or a duration string like "30m"
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def run_session(url: str, args, window_drop: float, tmp: str) -> Dict[str, Any]:
+    from conversation_manager import ConversationManager
+    from game_settings import get_default_settings
+
+    host, port = url.rsplit(":", 1)
+    policy = {"": args.keep_alive} if args.keep_alive is not None else None
+    manager = ConversationManager(groq_api_key="unused", cerebras_api_key="unused", ollama_host=host,
+                                  ollama_port=int(port), db_path=os.path.join(tmp, f"session-{window_drop}.json"),
+                                  ollama_keep_alive=policy)
+    manager.ollama_client.WINDOW_DROP = window_drop
+    if args.preload:
+        manager.ollama_client.preload([args.model])
+
+    settings = get_default_settings("ollama")
+    settings.num_ctx = args.num_ctx
+    settings.num_predict = args.num_predict
+    manager.create_context("session", "ollama", args.model, SYSTEM_PROMPT, settings)
+    context = manager.get_context("session")
+
+    turns = []
+    for turn in range(args.turns):
+        if turn and args.idle:
+            time.sleep(args.idle)
+        first: List[float] = []
+        context.add_message("user", f"{USER_TURN} ({turn})")
+        sent = len(manager.ollama_client.window(context))
+        started = time.perf_counter()
+        reply = manager.generate(context, on_chunk=lambda text: first or first.append(time.perf_counter()), stream=True)
+        finished = time.perf_counter()
+        context.add_message("assistant", reply)
+        turns.append({"turn": turn, "history": len(context.history), "sent": sent,
+                      "ttft_ms": round(((first[0] if first else finished) - started) * 1000, 3),
+                      "total_ms": round((finished - started) * 1000, 3)})
+    return summarize(turns, window_drop)
+
+
+def summarize(turns: List[Dict[str, Any]], window_drop: float) -> Dict[str, Any]:
+    ttft = [t["ttft_ms"] for t in turns]
+    # Turn N+1 against turn N: close to 1 while each turn reuses the last one's cache
+    ratios = [b / a for a, b in zip(ttft, ttft[1:]) if a > 0]
+    median = statistics.median(ttft)
+    return {
+        "window_drop": window_drop,
+        "turns": len(turns),
+        "ttft_mean_ms": round(statistics.mean(ttft), 3),
+        "ttft_p50_ms": percentile(ttft, 0.50),
+        "ttft_p95_ms": percentile(ttft, 0.95),
+        "ttft_next_over_prev_p50": percentile(ratios, 0.50) if ratios else None,
+        "ttft_next_over_prev_p95": percentile(ratios, 0.95) if ratios else None,
+        "slow_turns": sum(1 for value in ttft if value > 2 * median),
+        "per_turn": turns,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure time to first token across a long Ollama session")
+    parser.add_argument("--turns", type=int, default=60)
+    parser.add_argument("--window-drops", type=float, nargs="+", default=[0.0, 0.25],
+                        help="OllamaClientWrapper.WINDOW_DROP values to compare")
+    parser.add_argument("--model", default="fake-model")
+    parser.add_argument("--num-ctx", type=int, default=2048)
+    parser.add_argument("--num-predict", type=int, default=128)
+    parser.add_argument("--keep-alive", type=keep_alive, default=None, help='e.g. "30m", "0" or "-1"')
+    parser.add_argument("--idle", type=float, default=0.0, help="Seconds between turns")
+    parser.add_argument("--preload", action="store_true", help="Load the model before the first turn")
+    parser.add_argument("--ollama-url", type=str, default=None, help="A real Ollama server, e.g. http://localhost:11434")
+    parser.add_argument("--load-latency", type=float, default=2.0, help="Fake cold load time")
+    parser.add_argument("--prefill-tokens-per-second", type=float, default=2000.0, help="Fake prompt processing pace")
+    parser.add_argument("--tokens-per-second", type=float, default=None, help="Fake generation pace")
+    parser.add_argument("--output", type=str, help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    fake = dict(load_latency=args.load_latency, prefill_tokens_per_second=args.prefill_tokens_per_second,
+                tokens_per_second=args.tokens_per_second)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for window_drop in args.window_drops:
+            with contextlib.ExitStack() as stack:
+                url = args.ollama_url
+                if url is None:
+                    url = stack.enter_context(FakeProviderServer("ollama", **fake)).url
+                # The wrappers echo streamed tokens to stdout; keep them out of the report.
+                devnull = stack.enter_context(open(os.devnull, "w"))
+                with contextlib.redirect_stdout(devnull):
+                    results.append(run_session(url, args, window_drop, tmp))
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": sys.version.split()[0],
+        "ollama": args.ollama_url or dict(fake, fake=True),
+        "num_ctx": args.num_ctx,
+        "keep_alive": args.keep_alive,
+        "results": results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
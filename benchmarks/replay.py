@@ -0,0 +1,193 @@
+# benchmarks/replay.py
+#
+# Re-issues traffic recorded with TRAFFIC_LOG=<path> against a server,
+# keeping the recorded gaps between requests (scaled by --speed) and the
+# order of requests on each context. Run from the repository root:
+#   python -m benchmarks.replay traffic.log --target http://127.0.0.1:5000
+#   python -m benchmarks.replay traffic.log --speed 10
+#   python -m benchmarks.replay traffic.log --speed max --fake-backend --fake-latency 0.3
+#
+# --fake-backend starts the app in-process against the fake providers in
+# benchmarks/fake_servers.py with an empty context store, so no API keys are
+# needed and recorded create_context calls rebuild the contexts.
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from benchmarks.fake_servers import FakeProviderServer
+from traffic import read_traffic
+
+# Scrapes and stats polls say nothing about capacity
+DEFAULT_SKIP = ("/metrics", "/scheduler_stats", "/request_stats")
+
+
+def percentile(samples: List[float], q: float) -> float:
+    return round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1000, 3)
+
+
+def summarize(samples: List[float], errors: int, wall: float) -> dict:
+    samples = sorted(samples)
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "throughput_rps": round(len(samples) / wall, 3) if wall else None,
+        "mean_ms": round(sum(samples) / len(samples) * 1000, 3),
+        "p50_ms": percentile(samples, 0.50),
+        "p95_ms": percentile(samples, 0.95),
+        "p99_ms": percentile(samples, 0.99),
+    }
+
+
+def send(target: str, record: dict, timeout: float):
+    data = None
+    headers = {}
+    if record["method"] != "GET":
+        data = json.dumps(record.get("body") or {}).encode()
+        headers["Content-Type"] = "application/json"
+    if record.get("request_id"):
+        headers["X-Request-Id"] = record["request_id"]
+    req = urllib.request.Request(target + record["route"], data=data, headers=headers, method=record["method"])
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            # Read to the end so streamed replies are timed to their last chunk
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        e.read()
+        return e.code
+
+
+def replay(records: List[dict], target: str, speed: Optional[float], concurrency: int, timeout: float) -> dict:
+    """Send `records` on their recorded schedule; speed None sends them as fast as possible."""
+    results: List[Optional[tuple]] = [None] * len(records)
+    previous: Dict[str, threading.Event] = {}
+    waits = []
+    for record in records:
+        # Requests on one context wait for the one before, so a prompt never
+        # overtakes the create_context it depends on
+        done = threading.Event()
+        waits.append((previous.get(record.get("context")), done))
+        if record.get("context"):
+            previous[record["context"]] = done
+
+    def run(i: int, record: dict, due: float):
+        before, done = waits[i]
+        picked = time.perf_counter()
+        try:
+            if before is not None:
+                before.wait()
+            started = time.perf_counter()
+            try:
+                status = send(target, record, timeout)
+            except Exception as e:
+                print(f"[DEBUG] Replay of {record['route']} failed: {e}", file=sys.stderr)
+                status = None
+            results[i] = (record["route"].split("?")[0], status, time.perf_counter() - started, picked - due)
+        finally:
+            done.set()
+
+    first = records[0]["t"] if records else 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for i, record in enumerate(records):
+            due = started
+            if speed:
+                due += (record["t"] - first) / speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            pool.submit(run, i, record, due)
+    wall = time.perf_counter() - started
+
+    by_route: Dict[str, List[tuple]] = {}
+    for result in results:
+        by_route.setdefault(result[0], []).append(result)
+    report = {"wall_seconds": round(wall, 3), "routes": {}}
+    for route, rows in sorted(by_route.items()):
+        errors = sum(1 for _, status, _, _ in rows if status is None or status >= 400)
+        report["routes"][route] = summarize([elapsed for _, _, elapsed, _ in rows], errors, wall)
+    report["total"] = summarize([r[2] for r in results], sum(v["errors"] for v in report["routes"].values()), wall)
+    # How late requests were picked up, not counting waits on their context;
+    # large values mean the replay itself (or --concurrency) was the bottleneck
+    report["dispatch_lag_p99_ms"] = percentile(sorted(max(0.0, r[3]) for r in results), 0.99)
+    return report
+
+
+@contextlib.contextmanager
+def fake_backend(args):
+    """Serve main.app on a free port against fake providers and a scratch store."""
+    fake = dict(latency=args.fake_latency, tokens_per_second=args.fake_tokens_per_second)
+    with tempfile.TemporaryDirectory() as tmp, \
+            FakeProviderServer("openai", **fake) as openai_server, \
+            FakeProviderServer("ollama", **fake) as ollama_server:
+        host, port = ollama_server.url.rsplit(":", 1)
+        os.environ.update({
+            "GROQ_API_KEY": "fake", "CEREBRAS_API_KEY": "fake",
+            "GROQ_BASE_URL": openai_server.url, "CEREBRAS_BASE_URL": openai_server.url,
+            "OLLAMA_HOST": host, "OLLAMA_PORT": port,
+            "CONTEXT_DB": os.path.join(tmp, "contexts.json"),
+        })
+        os.environ.pop("TRAFFIC_LOG", None)
+        from werkzeug.serving import make_server
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            import main
+            server = make_server("127.0.0.1", 0, main.app, threaded=True)
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            try:
+                yield f"http://127.0.0.1:{server.server_port}"
+            finally:
+                server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded traffic against a server")
+    parser.add_argument("log", help="Traffic log written via TRAFFIC_LOG (rotated backups are read too)")
+    parser.add_argument("--target", default="http://127.0.0.1:5000")
+    parser.add_argument("--speed", default="1", help="Time scale: 1 for real time, 10 for 10x, or 'max'")
+    parser.add_argument("--concurrency", type=int, default=64, help="Most requests in flight at once")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--routes", nargs="+", help="Only replay these routes")
+    parser.add_argument("--limit", type=int, help="Only replay the first N requests")
+    parser.add_argument("--fake-backend", action="store_true", help="Replay against an in-process server with fake providers")
+    parser.add_argument("--fake-latency", type=float, default=0.0)
+    parser.add_argument("--fake-tokens-per-second", type=float, default=None)
+    parser.add_argument("--output", type=str, help="Write the report as JSON to this file")
+    args = parser.parse_args()
+
+    speed = None if args.speed == "max" else float(args.speed)
+    records = [r for r in read_traffic(args.log)
+               if (r["route"].split("?")[0] in args.routes if args.routes else r["route"].split("?")[0] not in DEFAULT_SKIP)]
+    records.sort(key=lambda r: r["t"])
+    records = records[:args.limit] if args.limit else records
+    if not records:
+        parser.error(f"No requests to replay in {args.log}")
+
+    with (fake_backend(args) if args.fake_backend else contextlib.nullcontext(args.target)) as target:
+        report = replay(records, target, speed, args.concurrency, args.timeout)
+
+    report.update({
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "log": args.log,
+        "target": "fake-backend" if args.fake_backend else args.target,
+        "speed": args.speed,
+        "recorded_seconds": round(records[-1]["t"] - records[0]["t"], 3),
+    })
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+# benchmarks/run.py
+#
+# End-to-end benchmark of the server's own overhead against the fake
+# providers in benchmarks/fake_servers.py. No API keys or Ollama needed.
+# Run from the repository root:
+#   python -m benchmarks.run --output bench.json
+#   python -m benchmarks.run --latency 0.3 --tokens-per-second 250 --stream
+#
+# The shared manager in manager_instance is configured from the environment
+# at import time, so the environment is set up before game_logic is imported.
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+from benchmarks.corpus import SYSTEM_PROMPT, USER_TURN, ASSISTANT_TURN, game_corpus
+from benchmarks.fake_servers import FakeProviderServer
+
+MODELS = {"groq": "fake-groq", "cerebras": "fake-cerebras", "ollama": "fake-ollama"}
+
+
+def timed(fn: Callable[[int], object], ops: int) -> Dict[str, float]:
+    samples = []
+    for i in range(ops):
+        started = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+
+    def percentile(q: float) -> float:
+        return round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1000, 3)
+
+    return {
+        "ops": ops,
+        "total_seconds": round(sum(samples), 4),
+        "mean_ms": round(statistics.mean(samples) * 1000, 3),
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+    }
+
+
+def fill_history(context, messages: int):
+    for i in range(messages // 2):
+        context.add_message("user", f"{USER_TURN} ({i})")
+        context.add_message("assistant", ASSISTANT_TURN)
+
+
+def make_context(manager, name: str, service: str, history: int, stream: bool):
+    from game_settings import get_default_settings
+    settings = get_default_settings(service)
+    settings.stream = stream
+    manager.delete_context(name)
+    manager.create_context(name, service, MODELS[service], SYSTEM_PROMPT, settings)
+    context = manager.get_context(name)
+    fill_history(context, history)
+    manager.autosave(context)
+    return context
+
+
+def bench_send_prompt(manager, args) -> List[dict]:
+    results = []
+    for service in args.services:
+        for history in args.history_sizes:
+            make_context(manager, "bench-send", service, history, args.stream)
+            result = timed(lambda i: manager.send_prompt("bench-send", f"{USER_TURN} [{i}]"), args.ops)
+            results.append(dict(scenario="send_prompt", service=service, history=history, stream=args.stream, **result))
+    return results
+
+
+def bench_game_turn(manager, args) -> List[dict]:
+    from game_logic import process_game_turn
+    results = []
+    for service in args.services:
+        for history in args.history_sizes:
+            context = make_context(manager, "bench-game", service, history, args.stream)
+            result = timed(lambda i: process_game_turn(context, f"Option {i % 4 + 1}"), args.ops)
+            results.append(dict(scenario="game_turn", service=service, history=history, stream=args.stream, **result))
+    return results
+
+
+def bench_copy_context(manager, args) -> List[dict]:
+    results = []
+    for history in args.history_sizes:
+        make_context(manager, "bench-copy-source", "groq", history, False)
+
+        def copy(i):
+            manager.copy_context("bench-copy-source", f"bench-copy-{i}")
+
+        result = timed(copy, args.ops)
+        for i in range(args.ops):
+            manager.delete_context(f"bench-copy-{i}")
+        results.append(dict(scenario="copy_context", history=history, **result))
+    return results
+
+
+def bench_autosave(args, tmp: str) -> List[dict]:
+    from conversation_manager import ConversationManager
+    results = []
+    for store in ("tinydb", "sqlite"):
+        for count in args.context_counts:
+            path = os.path.join(tmp, f"autosave-{store}-{count}")
+            manager = ConversationManager(groq_api_key="fake", cerebras_api_key="fake",
+                                          db_path=f"sqlite:{path}.db" if store == "sqlite" else f"{path}.json")
+            manager.store.save_many(game_corpus(count, max_turns=10))
+            manager.load_all_contexts_from_db()
+            context = manager.get_context("game-0")
+
+            def save(i):
+                context.add_message("user", f"{USER_TURN} [{i}]")
+                manager.autosave(context, new_messages=1)
+
+            results.append(dict(scenario="autosave", store=store, contexts=count, **timed(save, args.ops)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the server against fake providers")
+    parser.add_argument("--scenarios", nargs="+", default=["send_prompt", "game_turn", "copy_context", "autosave"])
+    parser.add_argument("--services", nargs="+", default=["groq", "cerebras", "ollama"])
+    parser.add_argument("--ops", type=int, default=50, help="Operations per measurement")
+    parser.add_argument("--history-sizes", type=int, nargs="+", default=[0, 100, 400])
+    parser.add_argument("--context-counts", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--stream", action="store_true", help="Stream replies from the fake providers")
+    parser.add_argument("--latency", type=float, default=0.0, help="Fake provider latency before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=None)
+    parser.add_argument("--tokens", type=int, default=64, help="Tokens per fake reply")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--output", type=str, help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    fake = dict(latency=args.latency, tokens_per_second=args.tokens_per_second, tokens=args.tokens,
+                error_rate=args.error_rate)
+    with tempfile.TemporaryDirectory() as tmp, \
+            FakeProviderServer("openai", **fake) as openai_server, \
+            FakeProviderServer("ollama", **fake) as ollama_server:
+        host, port = ollama_server.url.rsplit(":", 1)
+        os.environ.update({
+            "GROQ_API_KEY": "fake", "CEREBRAS_API_KEY": "fake",
+            "GROQ_BASE_URL": openai_server.url, "CEREBRAS_BASE_URL": openai_server.url,
+            "OLLAMA_HOST": host, "OLLAMA_PORT": port,
+            "CONTEXT_DB": os.path.join(tmp, "contexts.json"),
+        })
+        results = []
+        # The wrappers echo streamed tokens to stdout; keep them out of the report.
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            from manager_instance import manager
+            if "send_prompt" in args.scenarios:
+                results += bench_send_prompt(manager, args)
+            if "game_turn" in args.scenarios:
+                results += bench_game_turn(manager, args)
+            if "copy_context" in args.scenarios:
+                results += bench_copy_context(manager, args)
+            if "autosave" in args.scenarios:
+                results += bench_autosave(args, tmp)
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "fake_provider": fake,
+        "results": results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# benchmarks/shared_state.py
+#
+# Throughput of send_prompt with N worker processes sharing one SQLite store.
+# With the default --latency 0 generation is instant, so the numbers are the
+# manager and storage overhead; a latency shows how workers overlap provider waits.
+# Run from the repository root: python -m benchmarks.shared_state
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from conversation_manager import ConversationManager
+from game_settings import get_default_settings
+from benchmarks.corpus import ASSISTANT_TURN, SYSTEM_PROMPT, USER_TURN
+
+
+class SleepingClient:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def generate_response(self, context, **kwargs) -> str:
+        if self.latency:
+            time.sleep(self.latency)
+        return ASSISTANT_TURN
+
+
+def make_manager(db_path: str, latency: float = 0.0) -> ConversationManager:
+    manager = ConversationManager(groq_api_key="unused", cerebras_api_key="unused", db_path=f"sqlite:{db_path}")
+    manager.groq_client = SleepingClient(latency)
+    return manager
+
+
+def worker(db_path: str, num_contexts: int, duration: float, latency: float, seed: int, results):
+    manager = make_manager(db_path, latency)
+    rng = random.Random(seed)
+    ops = failures = 0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        result = manager.send_prompt(f"ctx-{rng.randrange(num_contexts)}", USER_TURN)
+        if result["success"]:
+            ops += 1
+        else:
+            failures += 1
+    results.put((ops, failures))
+
+
+def run(workers: int, num_contexts: int, duration: float, latency: float) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "contexts.db")
+        manager = make_manager(db_path)
+        for i in range(num_contexts):
+            manager.create_context(f"ctx-{i}", "groq", "llama-3.1-8b-instant", SYSTEM_PROMPT, get_default_settings("groq"))
+
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=worker, args=(db_path, num_contexts, duration, latency, seed, results))
+                     for seed in range(workers)]
+        for process in processes:
+            process.start()
+        totals = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+        ops = sum(ops for ops, _ in totals)
+        stored_messages = sum(len(record["history"]) for record in manager.store.load_all())
+        return {
+            "workers": workers,
+            "ops": ops,
+            "failures": sum(failures for _, failures in totals),
+            "ops_per_second": round(ops / duration, 1),
+            # Every successful turn must be stored exactly once, whoever won the race.
+            "lost_messages": num_contexts + 2 * ops - stored_messages,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure send_prompt throughput with several workers on one SQLite store")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--contexts", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated provider latency in seconds")
+    parser.add_argument("--output", type=str, help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = [run(workers, args.contexts, args.duration, args.latency) for workers in args.workers]
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# benchmarks/storage_dedup.py
+#
+# Compares the legacy one-document-per-context TinyDB layout with the
+# content-addressed ContextStore: file size and time to load every context.
+# Run from the repository root: python -m benchmarks.storage_dedup
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from tinydb import TinyDB
+
+from conversation_manager import ConversationContext
+from storage import ContextStore
+from benchmarks.corpus import game_corpus
+
+
+def measure_legacy(path: str, records) -> dict:
+    TinyDB(path).insert_multiple(records)
+    start = time.perf_counter()
+    contexts = [ConversationContext.from_dict(record) for record in TinyDB(path).all()]
+    elapsed = time.perf_counter() - start
+    return {"bytes": os.path.getsize(path), "load_seconds": round(elapsed, 3), "contexts": len(contexts)}
+
+
+def measure_content_addressed(path: str, records) -> dict:
+    ContextStore(path).save_many(records)
+    start = time.perf_counter()
+    contexts = [ConversationContext.from_dict(record) for record in ContextStore(path).load_all()]
+    elapsed = time.perf_counter() - start
+    return {"bytes": os.path.getsize(path), "load_seconds": round(elapsed, 3), "contexts": len(contexts)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure disk size and load time of stored contexts")
+    parser.add_argument("--sessions", type=int, default=10000)
+    parser.add_argument("--max-turns", type=int, default=20)
+    parser.add_argument("--copy-ratio", type=float, default=0.2)
+    parser.add_argument("--output", type=str, help="Write the result as JSON to this file")
+    args = parser.parse_args()
+
+    records = game_corpus(args.sessions, args.max_turns, args.copy_ratio)
+    with tempfile.TemporaryDirectory() as tmp:
+        result = {
+            "sessions": args.sessions,
+            "max_turns": args.max_turns,
+            "copy_ratio": args.copy_ratio,
+            "legacy": measure_legacy(os.path.join(tmp, "legacy.json"), records),
+            "content_addressed": measure_content_addressed(os.path.join(tmp, "content.json"), records),
+        }
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# cancellation.py
+
+import threading
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+class GenerationCancelled(Exception):
+    """Raised by a client wrapper when its request was cancelled mid-generation."""
+
+    def __init__(self, partial: str, tokens_received: int, tokens_saved: int):
+        super().__init__("Generation cancelled.")
+        self.partial = partial
+        self.tokens_received = tokens_received
+        self.tokens_saved = tokens_saved
+
+class CancelToken:
+    """Cancellation flag for one request.
+
+    Callbacks bound with bind() run on cancel(), from the cancelling thread;
+    the client wrappers bind the upstream stream's close() so a stalled read
+    is interrupted rather than waiting for its next chunk.
+    """
+
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], Any]] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def bind(self, callback: Callable[[], Any]):
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"[DEBUG] Error closing cancelled request {self.request_id}: {e}")
+
+class RequestRegistry:
+    """In-flight requests by id, so /cancel can reach them."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active: Dict[str, CancelToken] = {}
+        self._stats = {"cancelled": 0, "tokens_saved": 0, "partials_stored": 0}
+
+    def register(self, request_id: Optional[str] = None) -> CancelToken:
+        token = CancelToken(request_id or uuid.uuid4().hex)
+        with self._lock:
+            self._active[token.request_id] = token
+        return token
+
+    def unregister(self, token: CancelToken):
+        with self._lock:
+            if self._active.get(token.request_id) is token:
+                del self._active[token.request_id]
+
+    def cancel(self, request_id: str) -> bool:
+        with self._lock:
+            token = self._active.get(request_id)
+        if token is None:
+            return False
+        token.cancel()
+        return True
+
+    def record_cancelled(self, error: GenerationCancelled, stored: bool):
+        with self._lock:
+            self._stats["cancelled"] += 1
+            self._stats["tokens_saved"] += error.tokens_saved
+            self._stats["partials_stored"] += int(stored)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats, active=len(self._active))
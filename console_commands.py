@@ -4,6 +4,9 @@ import os
 from manager_instance import manager
 from game_settings import get_default_settings
 from game_logic import initialize_game, process_game_turn
+from scheduler import OverloadedError
+from metrics import metrics
+from profiling import profiler
 
 def display_menu():
     menu = f"""
@@ -15,7 +18,9 @@ def display_menu():
 5. Copy Context
 6. Toggle Autosave (Currently: {'Enabled' if manager.autosave_enabled else 'Disabled'})
 7. Start Game
-8. Exit
+8. Show Metrics
+9. Profiler (Currently: {'Enabled' if profiler.enabled else 'Disabled'})
+10. Exit
 =============================
 """
     print(menu)
@@ -33,15 +38,20 @@ def get_system_prompt():
         system_prompt = "You are a helpful assistant."
     return system_prompt
 
+def configure_tools(settings):
+    settings.use_tools = input("Enable tools? (y/n): ").lower() == 'y'
+    if settings.use_tools:
+        print(f"Available tools: {', '.join(manager.tools.stats())}")
+        names = input("Enter tool names, comma-separated (leave blank for all): ").strip()
+        for name in filter(None, (part.strip() for part in names.split(','))):
+            settings.add_tool(name)
+
 def configure_llm_settings(service):
     settings = get_default_settings(service)
     
     if service == 'cerebras':
         settings.stream = input("Enable streaming? (y/n): ").lower() == 'y'
-        settings.use_tools = input("Enable tools? (y/n): ").lower() == 'y'
-        if settings.use_tools:
-            # Add logic to configure tools
-            pass
+        configure_tools(settings)
         settings.temperature = float(input(f"Enter temperature (default: {settings.temperature}): ") or settings.temperature)
         settings.max_tokens = int(input(f"Enter max tokens (default: {settings.max_tokens}): ") or settings.max_tokens)
         settings.top_p = float(input(f"Enter top_p (default: {settings.top_p}): ") or settings.top_p)
@@ -54,6 +64,7 @@ def configure_llm_settings(service):
         json_mode = input("Enable JSON mode? (y/n): ").lower() == 'y'
         if json_mode:
             settings.response_format = {"type": "json_object"}
+        configure_tools(settings)
     
     elif service == 'ollama':
         settings.stream = input("Enable streaming? (y/n): ").lower() == 'y'
@@ -62,6 +73,8 @@ def configure_llm_settings(service):
         settings.top_k = int(input(f"Enter top_k (default: {settings.top_k}): ") or settings.top_k)
         settings.top_p = float(input(f"Enter top_p (default: {settings.top_p}): ") or settings.top_p)
         settings.repeat_penalty = float(input(f"Enter repeat_penalty (default: {settings.repeat_penalty}): ") or settings.repeat_penalty)
+        num_ctx = input("Enter num_ctx (default: the Ollama server's setting): ")
+        settings.num_ctx = int(num_ctx) if num_ctx else settings.num_ctx
     
     return settings
 
@@ -148,13 +161,12 @@ def send_prompt_console():
     if not name:
         print("[Error] Context name cannot be empty.")
         return
-    if name not in manager.contexts:
+    if manager.get_context(name) is None:
         print(f"[Error] Context '{name}' does not exist.")
         return
     send_prompt_loop(name)
 
 def send_prompt_loop(name: str):
-    context = manager.contexts[name]
     while True:
         prompt = input("Enter your prompt (or type 'exit' to return to main menu): ").strip()
         if prompt.lower() == 'exit':
@@ -162,7 +174,11 @@ def send_prompt_loop(name: str):
         if not prompt:
             print("[Error] Prompt cannot be empty.")
             continue
-        result = manager.send_prompt(name, prompt)
+        try:
+            result = manager.send_prompt(name, prompt, priority="interactive")
+        except OverloadedError as e:
+            print(f"[Error] {e} Try again in {e.retry_after:.0f}s.")
+            continue
         if result["success"]:
             print(f"\n[Assistant] {result['response']}\n")
         else:
@@ -184,18 +200,22 @@ def toggle_autosave_console():
 def start_game_console(name: str = None):
     if name is None:
         name = input("Enter the name of the context to use for the game: ").strip()
-    if name not in manager.contexts:
+    if manager.get_context(name) is None:
         print(f"[Error] Context '{name}' does not exist.")
         return
     start_game_loop(name)
 
 def start_game_loop(name: str):
-    context = manager.contexts[name]
+    context = manager.get_context(name)
     print(f"\nStarting game with context: {name}")
     print("Type 'exit' at any time to end the game.")
     
     # Initialize the game
-    game_state = initialize_game(context)
+    try:
+        game_state = initialize_game(context)
+    except OverloadedError as e:
+        print(f"[Error] {e} Try again in {e.retry_after:.0f}s.")
+        return
     print(game_state)
     
     while True:
@@ -204,9 +224,65 @@ def start_game_loop(name: str):
             print("Ending game. Returning to main menu.")
             break
         
-        game_response = process_game_turn(context, user_input)
+        context = manager.get_context(name) or context
+        try:
+            game_response = process_game_turn(context, user_input)
+        except OverloadedError as e:
+            game_response = f"[Error] {e} Try again in {e.retry_after:.0f}s."
         print(game_response)
 
+def show_metrics_console():
+    if not metrics.enabled:
+        print("[Info] Metrics are disabled (METRICS_ENABLED=0).")
+        return
+    rows = metrics.summary()
+    if not rows:
+        print("[Info] No requests recorded yet.")
+        return
+
+    def seconds(value):
+        return "-" if value is None else f"{value:.2f}s"
+
+    print("\n--- Metrics ---")
+    for row in rows:
+        print(f"{row['service']} / {row['model']}: {row['requests']} requests, {row['errors']} errors")
+        print(f"  generation avg {seconds(row['generation_avg'])}, p95 {seconds(row['generation_p95'])} | "
+              f"first token p50 {seconds(row['ttft_p50'])} | queue p95 {seconds(row['queue_p95'])}")
+        rate = row['tokens_per_second_p50']
+        print(f"  tokens: {row['prompt_tokens']:.0f} prompt, {row['completion_tokens']:.0f} completion | "
+              f"p50 {'-' if rate is None else f'{rate:.0f}'} tokens/s")
+    for service, stats in manager.scheduler.stats().items():
+        print(f"Scheduler {service}: {stats['queue_depth']} queued, {stats['running']} running, "
+              f"{stats['rejected_queue_full'] + stats['rejected_deadline']} rejected")
+    print("---------------")
+
+def profiler_console():
+    status = profiler.status()
+    target = f"context '{status['context']}'" if status['context'] else f"1 in {status['sample_every']} requests"
+    print(f"\n--- Profiler: {'on' if status['enabled'] else 'off'}, {target}, {status['format']} -> {status['output_dir']} ---")
+    for name in status['recent']:
+        print(f"  {name}")
+
+    mode = input("Profile (s)ampled requests, one (c)ontext, turn (o)ff, or leave blank to keep: ").strip().lower()
+    if mode == 's':
+        every = input(f"Profile 1 in how many requests? (default: {status['sample_every']}): ").strip()
+        result = profiler.configure(enabled=True, context="", sample_every=int(every) if every.isdigit() else None)
+    elif mode == 'c':
+        name = input("Enter context name to profile: ").strip()
+        if not name:
+            print("[Error] No context name given.")
+            return
+        result = profiler.configure(enabled=True, context=name)
+    elif mode == 'o':
+        result = profiler.configure(enabled=False)
+    else:
+        return
+    if mode != 'o':
+        fmt = input("Output format, pstats or collapsed (leave blank to keep): ").strip().lower()
+        if fmt:
+            result = profiler.configure(format=fmt)
+    print(f"[{'Success' if result['success'] else 'Error'}] {result['message']}")
+
 def exit_console():
     print("Exiting Conversation Manager. Goodbye!")
     exit()
@@ -220,13 +296,15 @@ def console_mode():
         '5': copy_context_console,
         '6': toggle_autosave_console,
         '7': start_game_console,
-        '8': exit_console
+        '8': show_metrics_console,
+        '9': profiler_console,
+        '10': exit_console
     }
 
     while True:
         display_menu()
-        choice = input("Select an option (1-8): ").strip()
-        action = options.get(choice, lambda: print("[Error] Invalid option. Please select a number between 1 and 8."))
+        choice = input("Select an option (1-10): ").strip()
+        action = options.get(choice, lambda: print("[Error] Invalid option. Please select a number between 1 and 10."))
         action()
 
 if __name__ == "__main__":
@@ -0,0 +1,169 @@
+# context_index.py
+
+import base64
+import bisect
+import json
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+SORTS = ("name", "last_active")
+ORDERS = ("asc", "desc")
+
+def preview(system_prompt: str) -> str:
+    return system_prompt[:50] + '...' if len(system_prompt) > 50 else system_prompt
+
+class _Sorted:
+    """Names kept in both sort orders, so a page is a bisect plus a slice."""
+    __slots__ = ("by_name", "by_activity")
+
+    def __init__(self):
+        self.by_name: List[str] = []
+        self.by_activity: List[Tuple[float, str]] = []
+
+    def add(self, name: str, last_active: float):
+        bisect.insort(self.by_name, name)
+        bisect.insort(self.by_activity, (last_active, name))
+
+    def remove(self, name: str, last_active: float):
+        i = bisect.bisect_left(self.by_name, name)
+        if i < len(self.by_name) and self.by_name[i] == name:
+            del self.by_name[i]
+        i = bisect.bisect_left(self.by_activity, (last_active, name))
+        if i < len(self.by_activity) and self.by_activity[i] == (last_active, name):
+            del self.by_activity[i]
+
+    def keys(self, sort: str) -> list:
+        return self.by_name if sort == "name" else self.by_activity
+
+class ContextIndex:
+    """Summaries of the contexts, indexed by service, model and last activity.
+
+    The manager keeps it in step with its contexts dict; list pages are read
+    from here without touching the contexts themselves. Request threads update
+    and page it concurrently, so every method holds the index's lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._all = _Sorted()
+        self._by_service: Dict[str, _Sorted] = {}
+        self._by_model: Dict[str, _Sorted] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+
+    def put(self, context):
+        """Add a context, or move it if its model or activity time changed."""
+        with self._lock:
+            entry = self._entries.get(context.name)
+            if entry is not None:
+                if (entry["service"], entry["model"], entry["last_active"]) == \
+                        (context.service, context.model, context.last_active):
+                    return
+                self._remove(context.name)
+            self._add(context)
+
+    def _add(self, context):
+        entry = {
+            "name": context.name,
+            "service": context.service,
+            "model": context.model,
+            "system_prompt": preview(context.system_prompt),
+            "last_active": context.last_active,
+        }
+        self._entries[context.name] = entry
+        for group in (self._all, self._by_service.setdefault(context.service, _Sorted()),
+                      self._by_model.setdefault(context.model, _Sorted())):
+            group.add(context.name, context.last_active)
+
+    def remove(self, name: str):
+        with self._lock:
+            self._remove(name)
+
+    def _remove(self, name: str):
+        entry = self._entries.pop(name, None)
+        if entry is None:
+            return
+        for index, key in ((self._by_service, entry["service"]), (self._by_model, entry["model"])):
+            group = index[key]
+            group.remove(name, entry["last_active"])
+            if not group.by_name:
+                del index[key]
+        self._all.remove(name, entry["last_active"])
+
+    def page(self, service: Optional[str] = None, model: Optional[str] = None, sort: str = "name",
+             order: str = "asc", limit: Optional[int] = None, cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Return up to `limit` summaries after `cursor`, and the cursor for the next page.
+
+        Filtering on both service and model walks the model's index and skips
+        other services; a model name rarely spans services, so this stays
+        close to the page size.
+        """
+        if sort not in SORTS:
+            raise ValueError(f"Unknown sort: {sort}")
+        if order not in ORDERS:
+            raise ValueError(f"Unknown order: {order}")
+        after = decode_cursor(cursor, sort, order) if cursor else None
+        with self._lock:
+            return self._page(service, model, sort, order, limit, after)
+
+    def _page(self, service, model, sort, order, limit, after):
+        if model is not None:
+            group = self._by_model.get(model)
+        elif service is not None:
+            group = self._by_service.get(service)
+        else:
+            group = self._all
+        if group is None:
+            return [], None
+        keys = group.keys(sort)
+
+        if order == "asc":
+            i = bisect.bisect_right(keys, after) if after is not None else 0
+            positions = range(i, len(keys))
+        else:
+            i = bisect.bisect_left(keys, after) if after is not None else len(keys)
+            positions = range(i - 1, -1, -1)
+
+        page = []
+        last = None
+        for position in positions:
+            key = keys[position]
+            entry = self._entries[key if sort == "name" else key[1]]
+            if service is not None and entry["service"] != service:
+                continue
+            if limit is not None and len(page) == limit:
+                return page, encode_cursor(sort, order, last)
+            page.append(dict(entry))
+            last = key
+        return page, None
+
+def encode_cursor(sort: str, order: str, key) -> str:
+    data = json.dumps([sort, order, key], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+def decode_cursor(cursor: str, sort: str, order: str):
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_sort, cursor_order, key = json.loads(data)
+        # A name sort's key is a name; a last_active sort's is [time, name]
+        if cursor_sort == "name":
+            valid = isinstance(key, str)
+        else:
+            valid = (isinstance(key, list) and len(key) == 2 and isinstance(key[1], str)
+                     and isinstance(key[0], (int, float)) and not isinstance(key[0], bool))
+        if not valid:
+            raise ValueError
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor.")
+    if (cursor_sort, cursor_order) != (sort, order):
+        raise ValueError("Cursor does not match the requested sort order.")
+    return key if sort == "name" else tuple(key)
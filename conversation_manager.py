@@ -1,22 +1,52 @@
 # conversation_manager.py
 
-from typing import Dict, Any, Optional, List
+import json
+import threading
+import time
+from typing import Callable, Dict, Any, Iterator, Optional, List, Tuple
 from dataclasses import dataclass, field, asdict
 from game_settings import get_default_settings
+from messages import Message
 from api_clients import GroqClientWrapper, OllamaClientWrapper, CerebrasClientWrapper
-from tinydb import TinyDB, Query
+from storage import VersionConflict, content_hash, open_store
+from scheduler import PRIORITIES, OverloadedError, Scheduler
+from cancellation import CancelToken, GenerationCancelled, RequestRegistry
+from metrics import metrics
+from profiling import profiler
+from context_index import ContextIndex
+from tools import ToolRegistry, registry as default_tools
+from singleflight import SingleFlight
+from hedging import Hedger
 
-@dataclass
+# What happens to a turn cancelled mid-generation: "store" keeps the user
+# message and the partial assistant reply, "discard" drops the whole turn.
+CANCEL_POLICIES = ("discard", "store")
+
+@dataclass(slots=True)
 class ConversationContext:
     name: str
     service: str
     model: str
     system_prompt: str
     settings: Any
-    history: List[Dict[str, Any]] = field(default_factory=list)
+    history: List[Message] = field(default_factory=list)
+    version: int = 0
+    cancel_policy: str = "discard"
+    last_active: float = 0.0
+    # Opt-in backup backend for slow turns: {"service", "model", optional "delay" in seconds}
+    hedge: Optional[Dict[str, Any]] = None
+
+    def add_message(self, role: str, content: str) -> Message:
+        message = Message(role, content)
+        self.history.append(message)
+        return message
 
-    def add_message(self, role: str, content: str):
-        self.history.append({"role": role, "content": content})
+    def remove_message(self, message: Message):
+        """Take a message back off the history: that message object, not just the last one."""
+        for i in range(len(self.history) - 1, -1, -1):
+            if self.history[i] is message:
+                del self.history[i]
+                return
 
     def to_dict(self) -> Dict[str, Any]:
         return {
@@ -25,7 +55,11 @@ class ConversationContext:
             "model": self.model,
             "system_prompt": self.system_prompt,
             "settings": self.settings.__dict__ if hasattr(self.settings, '__dict__') else self.settings,
-            "history": self.history
+            "history": [message.to_dict() for message in self.history],
+            "version": self.version,
+            "cancel_policy": self.cancel_policy,
+            "last_active": self.last_active,
+            "hedge": self.hedge
         }
 
     @classmethod
@@ -39,105 +73,507 @@ class ConversationContext:
             model=data["model"],
             system_prompt=data["system_prompt"],
             settings=settings,
-            history=data.get("history", [])
+            history=[Message.from_dict(message) for message in data.get("history", [])],
+            version=data.get("version", 0),
+            cancel_policy=data.get("cancel_policy", "discard"),
+            last_active=data.get("last_active", 0.0),
+            hedge=data.get("hedge")
         )
 
 class ConversationManager:
-    def __init__(self, groq_api_key: Optional[str] = None, ollama_host: str = 'http://localhost', ollama_port: int = 11434, cerebras_api_key: Optional[str] = None):
+    # How often a save that lost a race with another worker is retried.
+    MAX_SAVE_RETRIES = 5
+    # Per-turn limits on tool use: model round trips that may ask for tools, and seconds
+    MAX_TOOL_ROUNDS = 4
+    TOOL_TURN_SECONDS = 30.0
+    # How long a turn's result is returned again to retries with the same Idempotency-Key
+    IDEMPOTENCY_TTL = 600.0
+    # send_prompt's result for a cancelled request
+    CANCELLED = {"success": False, "message": "Request cancelled.", "response": None, "cancelled": True}
+
+    def __init__(self, groq_api_key: Optional[str] = None, ollama_host: str = 'http://localhost', ollama_port: int = 11434, cerebras_api_key: Optional[str] = None, db_path: str = 'all_contexts.json', scheduler: Optional[Scheduler] = None,
+                 groq_base_url: Optional[str] = None, cerebras_base_url: Optional[str] = None,
+                 tools: Optional[ToolRegistry] = None, ollama_keep_alive: Optional[Dict[str, Any]] = None,
+                 hedger: Optional[Hedger] = None):
         self.contexts: Dict[str, ConversationContext] = {}
-        self.groq_client = GroqClientWrapper(api_key=groq_api_key)
-        self.ollama_client = OllamaClientWrapper(host=ollama_host, port=ollama_port)
-        self.cerebras_client = CerebrasClientWrapper(api_key=cerebras_api_key)
-        self.db = TinyDB('all_contexts.json')
+        # Summaries of self.contexts for list_contexts; updated wherever self.contexts changes
+        self.index = ContextIndex()
+        self.groq_client = GroqClientWrapper(api_key=groq_api_key, base_url=groq_base_url)
+        self.ollama_client = OllamaClientWrapper(host=ollama_host, port=ollama_port, keep_alive=ollama_keep_alive)
+        self.cerebras_client = CerebrasClientWrapper(api_key=cerebras_api_key, base_url=cerebras_base_url)
+        self.store = open_store(db_path)
+        self.scheduler = scheduler or Scheduler()
+        self.requests = RequestRegistry()
+        self.tools = tools or default_tools
+        self.flights = SingleFlight(ttl=self.IDEMPOTENCY_TTL)
+        self.hedger = hedger or Hedger()
         self.autosave_enabled = True
+        # One turn at a time per context, so its history stays in user/assistant pairs
+        self._turn_locks: Dict[str, threading.Lock] = {}
+        self._turn_locks_guard = threading.Lock()
         self.load_all_contexts_from_db()
 
+    def turn_lock(self, name: str) -> threading.Lock:
+        """The lock held from a turn's user message until its reply is saved."""
+        with self._turn_locks_guard:
+            lock = self._turn_locks.get(name)
+            if lock is None:
+                lock = self._turn_locks[name] = threading.Lock()
+            return lock
+
     def load_all_contexts_from_db(self):
         self.contexts = {}
-        for record in self.db.all():
+        self.index.clear()
+        with metrics.timer("storage_seconds", "load_all"):
+            records = self.store.load_all()
+        for record in records:
             try:
                 context = ConversationContext.from_dict(record)
                 self.contexts[context.name] = context
+                self.index.put(context)
             except Exception as e:
                 print(f"Error loading context: {e}")
 
-    def autosave(self, context: ConversationContext):
-        if not self.autosave_enabled:
+    def get_context(self, name: str) -> Optional[ConversationContext]:
+        """Return a context, reloading it first if another worker saved a newer version."""
+        if not self.store.shared:
+            return self.contexts.get(name)
+        version = self.store.version(name)
+        if version is None:
+            self.contexts.pop(name, None)
+            self.index.remove(name)
+            return None
+        context = self.contexts.get(name)
+        if context is None or context.version != version:
+            with metrics.timer("storage_seconds", "load"):
+                record = self.store.load(name)
+            if record is None:
+                self.contexts.pop(name, None)
+                self.index.remove(name)
+                return None
+            context = ConversationContext.from_dict(record)
+            self.contexts[name] = context
+            self.index.put(context)
+        return context
+
+    def autosave(self, context: ConversationContext, new_messages: int = 0):
+        """Persist a context.
+
+        If another worker saved the context first, the latest stored version is
+        loaded and the last `new_messages` messages are re-appended to it. The
+        merge happens in place, so callers holding `context` see the result.
+        The shared store is always written, whatever autosave_enabled says.
+        """
+        context.last_active = time.time()
+        self.index.put(context)
+        if not self.autosave_enabled and not self.store.shared:
             return
-        Context = Query()
-        self.db.upsert(context.to_dict(), Context.name == context.name)
+        for _ in range(self.MAX_SAVE_RETRIES):
+            try:
+                with metrics.timer("storage_seconds", "save"):
+                    context.version = self.store.save(context.to_dict(), expected_version=context.version)
+                return
+            except VersionConflict:
+                record = self.store.load(context.name) if self.store.shared else None
+                if record is None:
+                    print(f"[DEBUG] Context '{context.name}' was deleted while it was being updated.")
+                    return
+                latest = ConversationContext.from_dict(record)
+                appended = context.history[len(context.history) - new_messages:] if new_messages else []
+                context.history[:] = latest.history + appended
+                context.version = latest.version
+                if not appended:
+                    return
+        print(f"[DEBUG] Could not save context '{context.name}' after {self.MAX_SAVE_RETRIES} attempts.")
 
-    def create_context(self, name: str, service: str, model: str, system_prompt: str, settings: Any) -> Dict[str, Any]:
-        if name in self.contexts:
+    def _insert(self, context: ConversationContext) -> bool:
+        # Creates a context unless a context with that name already exists in the store.
+        context.last_active = time.time()
+        if self.autosave_enabled or self.store.shared:
+            try:
+                with metrics.timer("storage_seconds", "save"):
+                    context.version = self.store.save(context.to_dict(), expected_version=0)
+            except VersionConflict:
+                return False
+        self.contexts[context.name] = context
+        self.index.put(context)
+        return True
+
+    def create_context(self, name: str, service: str, model: str, system_prompt: str, settings: Any,
+                       cancel_policy: str = "discard", hedge: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        if self.get_context(name):
             return {"success": False, "message": f"Context '{name}' already exists."}
+        if cancel_policy not in CANCEL_POLICIES:
+            return {"success": False, "message": f"Unknown cancel policy: {cancel_policy}"}
+        error = self._check_hedge(hedge)
+        if error:
+            return {"success": False, "message": error}
+        if settings is None or isinstance(settings, dict):
+            # Settings sent over HTTP arrive as JSON; apply them over the service defaults
+            try:
+                defaults = get_default_settings(service)
+            except ValueError as e:
+                return {"success": False, "message": str(e)}
+            for key, value in (settings or {}).items():
+                setattr(defaults, key, value)
+            settings = defaults
 
-        context = ConversationContext(name, service, model, system_prompt, settings)
+        context = ConversationContext(name, service, model, system_prompt, settings, cancel_policy=cancel_policy,
+                                      hedge=hedge or None)
         context.add_message("system", system_prompt)
-        self.contexts[name] = context
-        self.autosave(context)
+        if not self._insert(context):
+            return {"success": False, "message": f"Context '{name}' already exists."}
         return {"success": True, "message": f"Context '{name}' created successfully."}
 
-    def list_contexts(self) -> Dict[str, Any]:
+    def _check_hedge(self, hedge: Optional[Dict[str, Any]]) -> Optional[str]:
+        if not hedge:
+            return None
+        if not isinstance(hedge, dict) or not hedge.get("model"):
+            return "A hedge needs a service and a model."
+        if self.client_for(hedge.get("service")) is None:
+            return f"Unknown hedge service: {hedge.get('service')}"
+        delay = hedge.get("delay")
+        if delay is not None and (not isinstance(delay, (int, float)) or delay < 0):
+            return "The hedge delay must be a number of seconds."
+        return None
+
+    def set_hedge(self, name: str, service: Optional[str] = None, model: Optional[str] = None,
+                  delay: Optional[float] = None) -> Dict[str, Any]:
+        """Race slow turns of a context against `service`/`model`; without a service, stop hedging."""
+        context = self.get_context(name)
+        if context is None:
+            return {"success": False, "message": f"Context '{name}' does not exist."}
+        hedge = {"service": service, "model": model, "delay": delay} if service else None
+        error = self._check_hedge(hedge)
+        if error:
+            return {"success": False, "message": error}
+        context.hedge = hedge
+        self.autosave(context)
+        if hedge:
+            return {"success": True, "message": f"Context '{name}' now hedges with {service}/{model}."}
+        return {"success": True, "message": f"Context '{name}' no longer hedges."}
+
+    def list_contexts(self, service: Optional[str] = None, model: Optional[str] = None, sort: str = "name",
+                      order: Optional[str] = None, limit: Optional[int] = None, cursor: Optional[str] = None) -> Dict[str, Any]:
+        """List context summaries, a page at a time when `limit` is given.
+
+        `sort` is "name" or "last_active" (newest first unless order="asc").
+        Pass the returned next_cursor, with the same filters and sort, to get
+        the following page; it is None on the last page. The shared store
+        answers pages itself, so other workers' contexts are listed without
+        loading them here.
+        """
+        order = order or ("desc" if sort == "last_active" else "asc")
+        pages = self.store if self.store.shared else self.index
+        try:
+            contexts, next_cursor = pages.page(service, model, sort, order, limit, cursor)
+        except ValueError as e:
+            return {"success": False, "message": str(e)}
+        return {"success": True, "contexts": contexts, "next_cursor": next_cursor}
+
+    def get_history(self, name: str, offset: Optional[int] = None, limit: Optional[int] = None,
+                    since: Optional[int] = None, tail: Optional[int] = None) -> Dict[str, Any]:
+        """Return part of a context's history.
+
+        Messages are numbered by position ("id"). Choose the range with one of
+        offset (from the start), since (ids after the given one) or tail (the
+        last N messages); limit caps offset and since ranges. next_offset is
+        set when more messages follow. The shared store reads just the range
+        from SQLite; otherwise the in-memory history is sliced.
+        """
+        if sum(value is not None for value in (offset, since, tail)) > 1:
+            return {"success": False, "message": "Use only one of offset, since or tail."}
+        for key, value, minimum in (("offset", offset, 0), ("limit", limit, 0), ("since", since, -1), ("tail", tail, 0)):
+            if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < minimum):
+                return {"success": False, "message": f"{key} must be an integer of at least {minimum}."}
+
+        if tail is not None:
+            start, stop = (-tail, None) if tail else (0, 0)
+        else:
+            start = since + 1 if since is not None else offset or 0
+            stop = start + limit if limit is not None else None
+
+        if self.store.shared:
+            with metrics.timer("storage_seconds", "history_range"):
+                result = self.store.history_range(name, start, stop)
+            if result is None:
+                return {"success": False, "message": f"Context '{name}' does not exist."}
+            total, rows = result
+        else:
+            context = self.contexts.get(name)
+            if context is None:
+                return {"success": False, "message": f"Context '{name}' does not exist."}
+            total = len(context.history)
+            first, last, _ = slice(start, stop).indices(total)
+            rows = [(seq, message.role, message.content)
+                    for seq, message in zip(range(first, last), context.history[first:last])]
+
+        next_offset = rows[-1][0] + 1 if rows and rows[-1][0] + 1 < total else None
         return {
             "success": True,
-            "contexts": [
-                {
-                    "name": ctx.name,
-                    "service": ctx.service,
-                    "model": ctx.model,
-                    "system_prompt": ctx.system_prompt[:50] + '...' if len(ctx.system_prompt) > 50 else ctx.system_prompt
-                } for ctx in self.contexts.values()
-            ]
+            "name": name,
+            "total": total,
+            "messages": [{"id": seq, "role": role, "content": content} for seq, role, content in rows],
+            "next_offset": next_offset
         }
 
+    def iter_history(self, name: str, batch_size: int = 500) -> Iterator[Dict[str, Any]]:
+        """Yield a whole history a batch at a time, for exports."""
+        offset = 0
+        while offset is not None:
+            result = self.get_history(name, offset=offset, limit=batch_size)
+            if not result["success"]:
+                return
+            yield from result["messages"]
+            offset = result["next_offset"]
+
     def delete_context(self, name: str) -> Dict[str, Any]:
-        if self.contexts.pop(name, None):
-            Context = Query()
-            self.db.remove(Context.name == name)
+        if self.get_context(name):
+            self.contexts.pop(name, None)
+            self.index.remove(name)
+            with self._turn_locks_guard:
+                self._turn_locks.pop(name, None)
+            with metrics.timer("storage_seconds", "delete"):
+                self.store.delete(name)
             return {"success": True, "message": f"Context '{name}' deleted."}
         return {"success": False, "message": f"Context '{name}' does not exist."}
 
-    def send_prompt(self, name: str, prompt: str) -> Dict[str, Any]:
-        if name not in self.contexts:
+    def client_for(self, service: str):
+        if service == 'groq':
+            return self.groq_client
+        elif service == 'ollama':
+            return self.ollama_client
+        elif service == 'cerebras':
+            return self.cerebras_client
+        return None
+
+    def generate(self, context: ConversationContext, priority: str = "normal", on_chunk=None,
+                 stream: Optional[bool] = None, cancel_token: Optional[CancelToken] = None) -> str:
+        """Generate the next assistant reply for a context whose history ends with the new user message.
+
+        The call waits for a scheduler slot. If it is not admitted, the user
+        message is taken back off the history and OverloadedError is raised.
+        Callers hold turn_lock(context.name) around the whole turn.
+        If the request is cancelled, the turn is kept or dropped according to
+        the context's cancel_policy and GenerationCancelled is raised.
+        """
+        client = self.client_for(context.service)
+        prompt = context.history[-1]
+        token = cancel_token or self.requests.register()
+        tools = self.tools.specs(context.settings.tools) if getattr(context.settings, 'use_tools', False) else None
+
+        def call():
+            # Time outside this phase but inside "generate" was spent queued
+            with profiler.phase("upstream"):
+                return client.generate_response(context, cancel_token=token, on_chunk=on_chunk, stream=stream)
+
+        try:
+            if tools:
+                return self._generate_with_tools(context, client, tools, token, priority, on_chunk)
+            if context.hedge:
+                with profiler.phase("upstream"):
+                    return self._generate_hedged(context, token, priority, on_chunk)
+            return self.scheduler.run(context.service, context.model, call, priority)
+        except OverloadedError:
+            context.remove_message(prompt)
+            raise
+        except GenerationCancelled as e:
+            stored = context.cancel_policy == "store" and bool(e.partial)
+            if stored:
+                context.add_message("assistant", e.partial)
+                self.autosave(context, new_messages=2)
+            else:
+                context.remove_message(prompt)
+            self.requests.record_cancelled(e, stored)
+            metrics.inc("llm_cancelled_total", context.service, context.model)
+            metrics.inc("llm_tokens_saved_total", context.service, context.model, amount=e.tokens_saved)
+            raise
+        finally:
+            if cancel_token is None:
+                self.requests.unregister(token)
+
+    def _generate_with_tools(self, context: ConversationContext, client, tools: List[Dict[str, Any]], token,
+                             priority: str, on_chunk=None) -> str:
+        """Call the model and run the tools it asks for until it answers.
+
+        Each round holds a scheduler slot only for its upstream call, not while
+        the tools run. Once MAX_TOOL_ROUNDS rounds or TOOL_TURN_SECONDS are used
+        up, a last round without tools asks for the answer. Rounds are not
+        streamed; `on_chunk` gets the answer in one piece. The tool messages
+        live only for the turn: the history keeps the final reply.
+        """
+        messages = list(context.history)
+        deadline = time.monotonic() + self.TOOL_TURN_SECONDS
+        for rounds in range(self.MAX_TOOL_ROUNDS + 1):
+            offered = tools if rounds < self.MAX_TOOL_ROUNDS and time.monotonic() < deadline else None
+
+            def call():
+                with profiler.phase("upstream"):
+                    return client.generate_reply(context, messages, offered, token)
+
+            text, calls = self.scheduler.run(context.service, context.model, call, priority)
+            if not calls or offered is None:
+                if on_chunk and text:
+                    on_chunk(text)
+                return text
+            messages.append({
+                "role": "assistant",
+                "content": text,
+                "tool_calls": [{"id": c["id"], "type": "function",
+                                "function": {"name": c["name"], "arguments": c["arguments"]}} for c in calls],
+            })
+            with profiler.phase("tools"):
+                results = self.tools.run(calls, deadline)
+            messages.extend({"role": "tool", "tool_call_id": c["id"], "name": c["name"], "content": result}
+                            for c, result in zip(calls, results))
+
+    def _generate_hedged(self, context: ConversationContext, token, priority: str, on_chunk=None) -> str:
+        """Generate on the context's backend, hedged with its backup; only the winner's reply is returned.
+
+        The backup sees the same history through a throwaway context with the
+        backup service's settings, so nothing it does reaches the history.
+        Both legs always stream, whatever the context's stream setting, so
+        cancelling the loser closes its upstream request and frees its
+        scheduler slot; the caller gets the winner's text collected whole.
+        """
+        backup = ConversationContext(context.name, context.hedge["service"], context.hedge["model"],
+                                     context.system_prompt, self._hedge_settings(context), history=context.history)
+
+        def leg(target: ConversationContext):
+            client = self.client_for(target.service)
+
+            def run(leg_token, on_leg_chunk):
+                return self.scheduler.run(target.service, target.model, lambda: client.generate_response(
+                    target, cancel_token=leg_token, on_chunk=on_leg_chunk, stream=True), priority)
+            return run
+
+        prefixes = tuple(f"{client.name} Error:" for client in (self.groq_client, self.ollama_client, self.cerebras_client))
+        return self.hedger.run((context.service, context.model), leg(context), leg(backup),
+                               failed=lambda text: not text or text.startswith(prefixes),
+                               token=token, on_chunk=on_chunk, delay=context.hedge.get("delay"))
+
+    def _hedge_settings(self, context: ConversationContext):
+        # The backup service's defaults, with the sampling settings both services have
+        settings = get_default_settings(context.hedge["service"])
+        for key in ("temperature", "top_p", "max_tokens", "num_predict"):
+            if hasattr(settings, key) and hasattr(context.settings, key):
+                setattr(settings, key, getattr(context.settings, key))
+        return settings
+
+    def cancel_request(self, request_id: str) -> Dict[str, Any]:
+        if self.requests.cancel(request_id):
+            return {"success": True, "message": f"Request '{request_id}' cancelled."}
+        return {"success": False, "message": f"Request '{request_id}' is not in progress."}
+
+    def coalesce(self, kind: str, name: str, prompt: str, run: Callable[[CancelToken], Any],
+                 idempotency_key: Optional[str] = None, succeeded: Optional[Callable[[Any], bool]] = None,
+                 request_id: Optional[str] = None, cancelled: Any = None) -> Tuple[Any, bool]:
+        """Run a turn once for every identical submission; returns its result and whether it was shared.
+
+        Submissions of the same kind, context, stored version and prompt that
+        arrive while the turn is in progress wait for it and get its result, so
+        the turn is recorded once. With an idempotency key, the turn is also
+        identified by the key, and results that `succeeded` accepts are returned
+        again to retries for IDEMPOTENCY_TTL seconds. Streamed chunks only go to
+        the submission that started the turn. With the shared store, those
+        results are kept in it too, so a retry that reaches another worker gets
+        them; waiting on a turn still in progress only works within one worker.
+
+        Each submission is registered under its own request_id. run() gets the
+        turn's cancel token, which is cancelled only once every submission
+        waiting on the turn has been cancelled; a submission cancelled before
+        that gets `cancelled` as its result.
+        """
+        caller = self.requests.register(request_id)
+        stored_key = None
+        try:
+            if idempotency_key:
+                key, remember = ("idempotency", kind, name, idempotency_key, prompt), succeeded
+                if self.store.shared:
+                    stored_key = content_hash(json.dumps(key))
+                    result = self.store.remembered(stored_key)
+                    if result is not None:
+                        metrics.inc("coalesced_requests_total", kind)
+                        return result, True
+            else:
+                context = self.get_context(name)
+                if context is None:
+                    return run(caller), False
+                key, remember = (kind, name, context.version, prompt), None
+            try:
+                result, shared = self.flights.do(key, run, remember, caller)
+            except GenerationCancelled:
+                return cancelled, True
+        finally:
+            self.requests.unregister(caller)
+        if stored_key and not shared and remember is not None and remember(result):
+            self.store.remember(stored_key, result, self.IDEMPOTENCY_TTL)
+        if shared:
+            metrics.inc("coalesced_requests_total", kind)
+        return result, shared
+
+    def send_prompt(self, name: str, prompt: str, priority: str = "normal", request_id: Optional[str] = None,
+                    on_chunk=None, stream: Optional[bool] = None, idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+        def run(token):
+            with profiler.profile("send_prompt", name):
+                return self._send_prompt(name, prompt, priority, token, on_chunk, stream)
+
+        result, shared = self.coalesce("send_prompt", name, prompt, run, idempotency_key,
+                                       succeeded=lambda result: result["success"], request_id=request_id,
+                                       cancelled=self.CANCELLED)
+        return dict(result, coalesced=True) if shared else result
+
+    def _send_prompt(self, name: str, prompt: str, priority: str, token: CancelToken,
+                     on_chunk, stream: Optional[bool]) -> Dict[str, Any]:
+        if priority not in PRIORITIES:
+            return {"success": False, "message": f"Unknown priority: {priority}", "response": None}
+        with self.turn_lock(name):
+            return self._turn(name, prompt, priority, token, on_chunk, stream)
+
+    def _turn(self, name: str, prompt: str, priority: str, token: CancelToken,
+              on_chunk, stream: Optional[bool]) -> Dict[str, Any]:
+        with profiler.phase("load"):
+            context = self.get_context(name)
+        if context is None:
             return {"success": False, "message": f"Context '{name}' does not exist.", "response": None}
+        if self.client_for(context.service) is None:
+            return {"success": False, "message": f"Unknown service: {context.service}", "response": None}
 
-        context = self.contexts[name]
         context.add_message("user", prompt)
-        
-        if context.service == 'groq':
-            response = self.groq_client.generate_response(context)
-        elif context.service == 'ollama':
-            response = self.ollama_client.generate_response(context)
-        elif context.service == 'cerebras':
-            response = self.cerebras_client.generate_response(context)
-        else:
-            return {"success": False, "message": f"Unknown service: {context.service}", "response": None}
+        try:
+            with profiler.phase("generate"):
+                response = self.generate(context, priority, on_chunk=on_chunk, stream=stream, cancel_token=token)
+        except GenerationCancelled as e:
+            return dict(self.CANCELLED, response=e.partial or None)
 
         if response:
             context.add_message("assistant", response)
-            self.autosave(context)
+            with profiler.phase("save"):
+                self.autosave(context, new_messages=2)
             return {"success": True, "response": response}
         return {"success": False, "message": "Failed to get a response.", "response": None}
 
     def copy_context(self, source_name: str, new_name: str, num_messages: Optional[int] = None) -> Dict[str, Any]:
-        if source_name not in self.contexts:
+        source_context = self.get_context(source_name)
+        if source_context is None:
             return {"success": False, "message": f"Source context '{source_name}' does not exist."}
-        if new_name in self.contexts:
+        if self.get_context(new_name):
             return {"success": False, "message": f"Context '{new_name}' already exists."}
 
-        source_context = self.contexts[source_name]
         new_context = ConversationContext(
             name=new_name,
             service=source_context.service,
             model=source_context.model,
             system_prompt=source_context.system_prompt,
             settings=source_context.settings,
-            history=list(source_context.history)
+            history=list(source_context.history),
+            cancel_policy=source_context.cancel_policy,
+            hedge=dict(source_context.hedge) if source_context.hedge else None
         )
 
         if num_messages is not None:
             new_context.history = [new_context.history[0]] + new_context.history[-num_messages:]
 
-        self.contexts[new_name] = new_context
-        self.autosave(new_context)
+        if not self._insert(new_context):
+            return {"success": False, "message": f"Context '{new_name}' already exists."}
         return {"success": True, "message": f"Context '{new_name}' copied from '{source_name}'."}
\ No newline at end of file
@@ -1,29 +1,62 @@
 # game_logic.py
 
 import json
-from typing import Dict, Any
-from manager_instance import manager  # Import the shared manager instance
+from typing import Callable, Dict, Any, Optional
+from manager_instance import manager, image_jobs  # Import the shared manager instance
+from cancellation import GenerationCancelled
+from profiling import profiler
+
+TURN_CANCELLED = "Error: Turn cancelled."
+
+def process_game_turn(context, user_input: str, request_id: Optional[str] = None,
+                      on_chunk: Optional[Callable[[str], Any]] = None, idempotency_key: Optional[str] = None,
+                      turn_start: Optional[int] = None) -> str:
+    # With on_chunk, the reply is streamed to it as it is generated. The same
+    # input submitted again while the turn runs gets this turn's output.
+    # turn_start is the history length before this turn's first message, when
+    # the caller added messages of its own before the user input.
+    def play(token):
+        with profiler.profile("game_turn", context.name):
+            return _play_turn(context, user_input, token, on_chunk, turn_start)
+
+    output, _ = manager.coalesce("game_turn", context.name, user_input, play, idempotency_key,
+                                 succeeded=lambda output: not output.startswith("Error:"),
+                                 request_id=request_id, cancelled=TURN_CANCELLED)
+    return output
+
+def _play_turn(context, user_input: str, token, on_chunk, turn_start: Optional[int]) -> str:
+    if manager.client_for(context.service) is None:
+        return f"Error: Unknown service {context.service}"
+    with manager.turn_lock(context.name):
+        return _locked_turn(context, user_input, token, on_chunk, turn_start)
+
+def _locked_turn(context, user_input: str, token, on_chunk, turn_start: Optional[int]) -> str:
+    turn_start = len(context.history) if turn_start is None else turn_start
 
-def process_game_turn(context, user_input: str) -> str:
     # Add the user's input to the conversation history
     context.add_message("user", user_input)
 
-    # Generate a response using the appropriate LLM client
-    if context.service == 'groq':
-        response = manager.groq_client.generate_response(context)
-    elif context.service == 'ollama':
-        response = manager.ollama_client.generate_response(context)
-    elif context.service == 'cerebras':
-        response = manager.cerebras_client.generate_response(context)
-    else:
-        return f"Error: Unknown service {context.service}"
+    # Game turns are interactive and go ahead of queued batch prompts
+    try:
+        with profiler.phase("generate"):
+            response = manager.generate(context, priority="interactive", cancel_token=token,
+                                        on_chunk=on_chunk, stream=True if on_chunk else None)
+    except GenerationCancelled:
+        return TURN_CANCELLED
 
     # Process the response
     try:
-        game_state = parse_response(response)
+        with profiler.phase("parse"):
+            game_state = parse_response(response)
         context.add_message("assistant", response)
+        with profiler.phase("save"):
+            manager.autosave(context, new_messages=len(context.history) - turn_start)
+        # The image is generated in the background; the turn is the assistant message's id
+        # The model can reply with valid JSON that is not an object
+        image = game_state.get("image") if isinstance(game_state, dict) else None
+        image_jobs.submit(context.name, len(context.history) - 1, image)
         return format_game_output(game_state)
-    except json.JSONDecodeError:
+    except ValueError:
         return f"Error: Invalid response format. Raw response: {response}"
 
 def parse_response(response: str) -> Dict[str, Any]:
@@ -44,6 +77,8 @@ def parse_response(response: str) -> Dict[str, Any]:
 
 def format_game_output(game_state: Dict[str, Any]) -> str:
     """Format the game state into a user-friendly output."""
+    if not isinstance(game_state, dict):
+        return json.dumps(game_state)
     output = []
 
     # Narration
@@ -106,8 +141,9 @@ IMPORTANT: Always respond in valid JSON format with the following structure:
 
 Do not include any text outside of this JSON structure."""
     }
+    turn_start = len(context.history)
     context.add_message("system", system_message["content"])
     
     # Generate initial game state
     initial_prompt = "Start a new isekai anime-themed adventure game. Describe the opening scene where the player is transported to a fantasy world."
-    return process_game_turn(context, initial_prompt)
\ No newline at end of file
+    return process_game_turn(context, initial_prompt, turn_start=turn_start)
\ No newline at end of file
@@ -0,0 +1,179 @@
+# game_sessions.py
+#
+# WebSocket game sessions: ws://<host>:<port>/game/<context name> binds one
+# connection to one game context. Needs the optional `websockets` package.
+#
+# Client -> server:
+#   {"type": "action", "input": "Option 2"}   queued behind the turn in progress
+#   {"type": "cancel"}                         cancels the turn in progress
+# Server -> client:
+#   {"type": "ready", "context": ..., "messages": N}
+#   {"type": "queued", "pending": N}
+#   {"type": "turn_started", "request_id": ...}
+#   {"type": "chunk", "text": ...}             the reply as it is generated
+#   {"type": "turn", "turn": id, "output": ...}
+#   {"type": "image", "turn": id, "status": "done" | "failed", ...}
+#   {"type": "error", "message": ...}
+
+import asyncio
+import json
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import unquote
+
+from manager_instance import manager, image_jobs
+from game_logic import process_game_turn
+from scheduler import OverloadedError
+
+try:
+    from websockets.asyncio.server import serve
+    from websockets.exceptions import ConnectionClosed
+except ImportError:
+    serve = None
+
+# Turns run on these threads; the scheduler still limits upstream concurrency
+TURN_WORKERS = int(os.getenv('WS_TURN_WORKERS', 32))
+MAX_MESSAGE_BYTES = 64 * 1024
+MAX_PENDING_ACTIONS = 8
+
+_executor = ThreadPoolExecutor(max_workers=TURN_WORKERS, thread_name_prefix="game-turn")
+# The event loop only keeps weak references to tasks
+_sending = set()
+
+class GameSession:
+    """One connection bound to one context.
+
+    An idle session is this object, a queue and one suspended task; turns
+    borrow a thread from the shared pool only while they run.
+    """
+    __slots__ = ("websocket", "context_name", "actions", "request_id")
+
+    def __init__(self, websocket, context_name: str):
+        self.websocket = websocket
+        self.context_name = context_name
+        self.actions: asyncio.Queue = asyncio.Queue(maxsize=MAX_PENDING_ACTIONS)
+        self.request_id: Optional[str] = None
+
+    async def send(self, message: Dict[str, Any]):
+        try:
+            await self.websocket.send(json.dumps(message))
+        except ConnectionClosed:
+            pass
+
+    def push(self, message: Dict[str, Any]):
+        # For callbacks on the event loop; keeps the order they were scheduled in
+        task = asyncio.ensure_future(self.send(message))
+        _sending.add(task)
+        task.add_done_callback(_sending.discard)
+
+    def cancel(self):
+        if self.request_id:
+            manager.cancel_request(self.request_id)
+
+    def accept(self, message: Any):
+        kind = message.get("type") if isinstance(message, dict) else None
+        if kind == "action":
+            user_input = message.get("input")
+            if not user_input or not isinstance(user_input, str):
+                self.push({"type": "error", "message": "Missing user input."})
+                return
+            try:
+                self.actions.put_nowait(user_input)
+            except asyncio.QueueFull:
+                self.push({"type": "error", "message": "Too many pending actions."})
+                return
+            self.push({"type": "queued", "pending": self.actions.qsize()})
+        elif kind == "cancel":
+            self.cancel()
+        else:
+            self.push({"type": "error", "message": f"Unknown message type: {kind}"})
+
+    async def run_turns(self):
+        loop = asyncio.get_running_loop()
+
+        def threadsafe_push(message: Dict[str, Any]):
+            loop.call_soon_threadsafe(self.push, message)
+
+        while True:
+            user_input = await self.actions.get()
+            self.request_id = uuid.uuid4().hex
+            await self.send({"type": "turn_started", "request_id": self.request_id})
+            try:
+                output, turn = await loop.run_in_executor(
+                    _executor, self._play, user_input, self.request_id,
+                    lambda text: threadsafe_push({"type": "chunk", "text": text}))
+            except OverloadedError as e:
+                await self.send({"type": "error", "message": str(e), "retry_after": e.retry_after})
+                continue
+            except Exception as e:
+                print(f"[DEBUG] Error in game session '{self.context_name}': {e}")
+                await self.send({"type": "error", "message": f"Error: {e}"})
+                continue
+            finally:
+                self.request_id = None
+            await self.send({"type": "turn", "turn": turn, "output": output})
+            if turn is not None:
+                image_jobs.subscribe(self.context_name, turn, lambda status: threadsafe_push(dict(status, type="image")))
+
+    def _play(self, user_input: str, request_id: str, on_chunk) -> Tuple[str, Optional[int]]:
+        context = manager.get_context(self.context_name)
+        if context is None:
+            return f"Error: Context '{self.context_name}' no longer exists.", None
+        output = process_game_turn(context, user_input, request_id, on_chunk=on_chunk)
+        # The turn is the id of the assistant message it added, as in /get_history
+        return output, None if output.startswith("Error:") else len(context.history) - 1
+
+async def handle(websocket):
+    path = websocket.request.path
+    name = unquote(path[len("/game/"):]) if path.startswith("/game/") else ""
+    if not name:
+        await websocket.close(1008, "Connect to /game/<context name>")
+        return
+    loop = asyncio.get_running_loop()
+    context = await loop.run_in_executor(_executor, manager.get_context, name)
+    if context is None:
+        await websocket.close(1008, f"Context '{name}' does not exist")
+        return
+
+    session = GameSession(websocket, name)
+    await session.send({"type": "ready", "context": name, "messages": len(context.history)})
+    runner = asyncio.create_task(session.run_turns())
+    try:
+        async for raw in websocket:
+            try:
+                message = json.loads(raw)
+            except ValueError:
+                await session.send({"type": "error", "message": "Messages must be JSON."})
+                continue
+            session.accept(message)
+    except ConnectionClosed:
+        pass
+    finally:
+        # A player who leaves mid-turn frees the upstream slot, as with /send_prompt_stream
+        runner.cancel()
+        session.cancel()
+
+async def _serve(host: str, port: int, started: list, ready: threading.Event):
+    # No per-message compression: its zlib state costs far more per connection than the frames save
+    async with serve(handle, host, port, compression=None, max_size=MAX_MESSAGE_BYTES, max_queue=4) as server:
+        started.append(server.sockets[0].getsockname()[1])
+        ready.set()
+        await server.serve_forever()
+
+def start_game_server(host: str, port: int) -> Optional[int]:
+    """Serve WebSocket game sessions from a background thread and return the port (0 picks a free one)."""
+    if serve is None:
+        print("[Warning] The websockets package is not installed; WebSocket game sessions are disabled.")
+        return None
+    started, ready = [], threading.Event()
+    threading.Thread(target=lambda: asyncio.run(_serve(host, port, started, ready)),
+                     name="game-sessions", daemon=True).start()
+    ready.wait(10)
+    if not started:
+        print(f"[Warning] WebSocket game sessions could not start on {host}:{port}.")
+        return None
+    print(f"WebSocket game sessions on ws://{host}:{started[0]}/game/<context name>")
+    return started[0]
@@ -7,7 +7,7 @@ class CerebrasSettings:
         self.temperature = 0.7
         self.max_tokens = 150
         self.top_p = 1.0
-        self.tools = []  # List to store tool configurations
+        self.tools = []  # Registered tool names or tool definitions; empty offers every registered tool
 
     def add_tool(self, tool):
         self.tools.append(tool)
@@ -19,6 +19,11 @@ class GroqSettings:
         self.max_tokens = 150
         self.top_p = 1.0
         self.response_format = None  # Can be set to {"type": "json_object"} for JSON mode
+        self.use_tools = False
+        self.tools = []  # Registered tool names or tool definitions; empty offers every registered tool
+
+    def add_tool(self, tool):
+        self.tools.append(tool)
 
 class OllamaSettings:
     def __init__(self):
@@ -28,6 +33,8 @@ class OllamaSettings:
         self.top_k = 40
         self.top_p = 0.9
         self.repeat_penalty = 1.1
+        self.num_ctx = None  # Context size to request and window to; None leaves it to the Ollama server
+        self.keep_alive = None  # e.g. "30m" or -1 (never unload); None uses the per-model policy
 
 def get_default_settings(service):
     if service == 'cerebras':
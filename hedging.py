@@ -0,0 +1,202 @@
+# hedging.py
+
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+from cancellation import CancelToken, GenerationCancelled
+from metrics import metrics
+
+# A leg runs one upstream request: leg(cancel_token, on_chunk) -> reply text
+Leg = Callable[[CancelToken, Callable[[str], Any]], str]
+
+class _Backend:
+    """Recent behaviour of one service/model as a primary."""
+    __slots__ = ("first_output", "hedged", "requests", "hedges", "backup_wins", "observed")
+
+    def __init__(self, window: int):
+        # Seconds to first output of its own requests, the hedge threshold's source
+        self.first_output: Deque[float] = deque(maxlen=window)
+        # Whether each recent request was hedged, for the hedge budget
+        self.hedged: Deque[bool] = deque(maxlen=window)
+        self.requests = 0
+        self.hedges = 0
+        self.backup_wins = 0
+        # Seconds to first output the caller saw, hedged or not
+        self.observed: Deque[float] = deque(maxlen=window)
+
+def _quantile(samples, q: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+class Hedger:
+    """Hedged requests: a backup backend raced against a primary that is slower than usual.
+
+    The threshold is the `quantile` of the primary's recent time to first
+    output (the first chunk a leg passes to its on_chunk, or its whole reply);
+    until `min_samples` are in, it is `default_delay`. Once the primary has
+    been silent that long, or has failed, the same request goes to the backup.
+    The first leg to produce output wins and the other is cancelled. At most
+    `max_rate` of a primary's recent requests are hedged, so an outage does
+    not double the load on the backup.
+    """
+
+    def __init__(self, quantile: float = 0.95, window: int = 200, min_samples: int = 20,
+                 default_delay: float = 1.0, max_rate: float = 0.2):
+        self.quantile = quantile
+        self.window = window
+        self.min_samples = min_samples
+        self.default_delay = default_delay
+        self.max_rate = max_rate
+        self._lock = threading.Lock()
+        self._backends: Dict[Tuple[str, str], _Backend] = {}
+
+    def _backend(self, key: Tuple[str, str]) -> _Backend:
+        backend = self._backends.get(key)
+        if backend is None:
+            backend = self._backends[key] = _Backend(self.window)
+        return backend
+
+    def threshold(self, service: str, model: str) -> float:
+        with self._lock:
+            samples = self._backend((service, model)).first_output
+            if len(samples) < self.min_samples:
+                return self.default_delay
+            return _quantile(samples, self.quantile)
+
+    def run(self, primary_key: Tuple[str, str], primary: Leg, backup: Leg, failed: Callable[[str], bool],
+            token: Optional[CancelToken] = None, on_chunk: Optional[Callable[[str], Any]] = None,
+            delay: Optional[float] = None) -> str:
+        """Run `primary`, hedged with `backup`, and return the winning reply.
+
+        `failed` tells error replies apart, as the client wrappers return them
+        as text. Cancelling `token` cancels both legs.
+        """
+        delay = self.threshold(*primary_key) if delay is None else delay
+        started = time.perf_counter()
+        lock = threading.Lock()
+        done: queue.Queue = queue.Queue()
+        tokens: Dict[str, CancelToken] = {}
+        starts: Dict[str, float] = {}
+        state = {"winner": None, "first": None}
+
+        def launch(name: str, leg: Leg) -> bool:
+            leg_token = CancelToken(f"{token.request_id if token else 'hedge'}-{name}")
+            with lock:
+                if state["winner"] is not None:
+                    return False
+                tokens[name] = leg_token
+            if token is not None:
+                token.bind(leg_token.cancel)
+            starts[name] = time.perf_counter()
+
+            def claim() -> bool:
+                # The first leg with output wins; the other is cancelled
+                with lock:
+                    if state["winner"] is not None:
+                        return state["winner"] == name
+                    state["winner"], state["first"] = name, time.perf_counter()
+                    other = tokens.get("backup" if name == "primary" else "primary")
+                # When the backup wins, the primary would have taken at least this
+                # long; leaving its slow requests out would pull the threshold down
+                self._observe(primary_key, state["first"] - starts["primary"])
+                if other is not None:
+                    other.cancel()
+                return True
+
+            def chunk(text: str):
+                if claim() and on_chunk:
+                    on_chunk(text)
+
+            def body():
+                try:
+                    result = leg(leg_token, chunk)
+                    if not failed(result):
+                        claim()
+                except BaseException as e:
+                    result = e
+                done.put((name, result))
+
+            threading.Thread(target=body, name=f"hedge-{name}", daemon=True).start()
+            return True
+
+        launch("primary", primary)
+        with self._lock:
+            backend = self._backend(primary_key)
+            backend.requests += 1
+            may_hedge = sum(backend.hedged) <= self.max_rate * len(backend.hedged)
+
+        results = {}
+        hedged = False
+        while True:
+            try:
+                timeout = started + delay - time.perf_counter() if may_hedge else None
+                name, result = done.get(timeout=max(0.0, timeout) if timeout is not None else None)
+                results[name] = result
+            except queue.Empty:
+                name = None
+            if may_hedge and (name is None or (name == "primary" and self._lost(result, failed))):
+                # The primary is slow or has failed; hedge once, unless the request was cancelled
+                may_hedge = False
+                if token is None or not token.cancelled:
+                    hedged = launch("backup", backup)
+            if name is None:
+                continue
+
+            winner = state["winner"]
+            if winner is not None and winner in results:
+                break
+            if winner is None and len(results) == (2 if hedged else 1):
+                # Nothing produced output: report the primary's failure
+                winner = "primary"
+                break
+
+        first = state["first"] if state["first"] is not None else time.perf_counter()
+        self._record(backend, hedged, winner, first - started)
+        result = results[winner]
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+    def _lost(self, result, failed) -> bool:
+        if isinstance(result, GenerationCancelled):
+            return False
+        return isinstance(result, BaseException) or failed(result)
+
+    def _observe(self, key: Tuple[str, str], seconds: float):
+        with self._lock:
+            self._backend(key).first_output.append(seconds)
+
+    def _record(self, backend: _Backend, hedged: bool, winner: str, first_output: float):
+        with self._lock:
+            backend.hedged.append(hedged)
+            backend.observed.append(first_output)
+            backend.hedges += hedged
+            backend.backup_wins += winner == "backup"
+        metrics.inc("hedged_requests_total", "backup" if winner == "backup" else "primary" if hedged else "unhedged")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            items = list(self._backends.items())
+        stats = {}
+        for (service, model), backend in items:
+            threshold = self.threshold(service, model)
+            with self._lock:
+                observed = list(backend.observed)
+                stats[f"{service}/{model}"] = {
+                    "requests": backend.requests,
+                    "hedged": backend.hedges,
+                    "backup_wins": backend.backup_wins,
+                    "hedge_rate": round(backend.hedges / backend.requests, 4) if backend.requests else 0.0,
+                    "threshold_ms": round(threshold * 1000, 1),
+                    "primary_first_output_p99_ms": _ms(_quantile(backend.first_output, 0.99)),
+                    "first_output_p50_ms": _ms(_quantile(observed, 0.50)),
+                    "first_output_p99_ms": _ms(_quantile(observed, 0.99)),
+                }
+        return stats
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return round(seconds * 1000, 1) if seconds is not None else None
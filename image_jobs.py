@@ -0,0 +1,194 @@
+# image_jobs.py
+
+import json
+import queue
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from storage import content_hash
+from metrics import metrics
+
+class StubImageBackend:
+    """Stands in for a Stable Diffusion service: returns no image, optionally after a delay."""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+
+    def generate(self, prompt: str) -> Dict[str, Any]:
+        if self.delay:
+            time.sleep(self.delay)
+        return {"images": [], "stub": True}
+
+class HTTPImageBackend:
+    """Calls an Automatic1111-compatible /sdapi/v1/txt2img endpoint; images come back base64-encoded."""
+
+    def __init__(self, url: str, steps: int = 20, width: int = 512, height: int = 512, timeout: float = 120.0):
+        self.url = url.rstrip('/') + '/sdapi/v1/txt2img'
+        self.steps = steps
+        self.width = width
+        self.height = height
+        self.timeout = timeout
+
+    def generate(self, prompt: str) -> Dict[str, Any]:
+        payload = {"prompt": prompt, "steps": self.steps, "width": self.width, "height": self.height}
+        request = urllib.request.Request(self.url, data=json.dumps(payload).encode(),
+                                         headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return {"images": json.loads(response.read()).get("images", [])}
+
+@dataclass(slots=True)
+class ImageJob:
+    id: str
+    prompt: str
+    status: str = "queued"  # queued, running, done, failed
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    created: float = field(default_factory=time.time)
+    finished: Optional[float] = None
+
+class ImageJobQueue:
+    """Generates scene images in the background so game turns never wait on them.
+
+    Jobs are keyed by (context, turn), the turn being the id of the assistant
+    message the image belongs to. Turns with the same prompt share one job. The
+    queue is bounded: when it is full, submit() turns the job away instead of
+    blocking. Finished jobs are kept for the last `max_results` prompts.
+    """
+
+    def __init__(self, backend=None, workers: int = 2, max_queue: int = 32, max_results: int = 256):
+        self.backend = backend or StubImageBackend()
+        self.max_results = max_results
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._cond = threading.Condition()
+        self._jobs: Dict[str, ImageJob] = {}
+        self._finished: OrderedDict = OrderedDict()
+        self._turns: OrderedDict = OrderedDict()
+        self._latest: Dict[str, int] = {}
+        self._watchers: Dict[str, List[Tuple[str, int, Callable]]] = {}
+        self._stats = {"submitted": 0, "deduplicated": 0, "rejected": 0, "done": 0, "failed": 0}
+        for i in range(workers):
+            threading.Thread(target=self._work, name=f"image-worker-{i}", daemon=True).start()
+
+    def submit(self, context: str, turn: int, image: Any) -> Dict[str, Any]:
+        """Queue the image for a game turn; never blocks."""
+        prompt = image.get("prompt") if isinstance(image, dict) else None
+        if not prompt or not isinstance(prompt, str):
+            return {"success": False, "message": "No image prompt in this turn."}
+        key = content_hash(prompt)
+        with self._cond:
+            self._stats["submitted"] += 1
+            job = self._jobs.get(key)
+            if job is not None:
+                self._stats["deduplicated"] += 1
+                metrics.inc("image_jobs_total", "deduplicated")
+            else:
+                job = ImageJob(key, prompt)
+                try:
+                    self._queue.put_nowait(job)
+                except queue.Full:
+                    self._stats["rejected"] += 1
+                    metrics.inc("image_jobs_total", "rejected")
+                    return {"success": False, "message": "Image queue is full."}
+                self._jobs[key] = job
+            self._remember_turn(context, turn, job, image)
+        return {"success": True, "job_id": job.id, "status": job.status}
+
+    def _remember_turn(self, context: str, turn: int, job: ImageJob, image: Dict[str, Any]):
+        self._turns[(context, turn)] = (job, image.get("top"), image.get("bottom"))
+        self._turns.move_to_end((context, turn))
+        while len(self._turns) > self.max_results * 4:
+            self._turns.popitem(last=False)
+        self._latest[context] = turn
+
+    def status(self, context: str, turn: Optional[int] = None) -> Dict[str, Any]:
+        """Poll a turn's image; without `turn`, the context's latest one."""
+        with self._cond:
+            return self._describe(context, turn)
+
+    def wait(self, context: str, turn: Optional[int] = None, timeout: float = 30.0) -> Dict[str, Any]:
+        """Like status(), but wait up to `timeout` seconds for the image to finish."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                result = self._describe(context, turn)
+                remaining = deadline - time.monotonic()
+                if not result["success"] or result["status"] in ("done", "failed") or remaining <= 0:
+                    return result
+                self._cond.wait(remaining)
+
+    def _describe(self, context: str, turn: Optional[int]) -> Dict[str, Any]:
+        turn = self._latest.get(context) if turn is None else turn
+        entry = self._turns.get((context, turn))
+        if entry is None:
+            return {"success": False, "message": f"No image job for context '{context}' turn {turn}."}
+        job, top, bottom = entry
+        return {
+            "success": True,
+            "context": context,
+            "turn": turn,
+            "job_id": job.id,
+            "status": job.status,
+            "prompt": job.prompt,
+            "top": top,
+            "bottom": bottom,
+            "result": job.result,
+            "error": job.error,
+        }
+
+    def subscribe(self, context: str, turn: int, callback: Callable[[Dict[str, Any]], Any]) -> bool:
+        """Call `callback` with the turn's status once its image is finished, from a worker thread.
+
+        Runs the callback right away if the image is already finished; returns
+        False if there is no job for the turn.
+        """
+        with self._cond:
+            result = self._describe(context, turn)
+            if not result["success"]:
+                return False
+            if result["status"] not in ("done", "failed"):
+                self._watchers.setdefault(result["job_id"], []).append((context, turn, callback))
+                return True
+        callback(result)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return dict(self._stats, queue_depth=self._queue.qsize(), cached=len(self._finished))
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            with self._cond:
+                job.status = "running"
+            started = time.perf_counter()
+            try:
+                result, error = self.backend.generate(job.prompt), None
+            except Exception as e:
+                print(f"[DEBUG] Image generation failed: {e}")
+                result, error = None, str(e)
+            metrics.observe("image_job_seconds", time.perf_counter() - started, type(self.backend).__name__)
+            with self._cond:
+                job.result, job.error = result, error
+                job.status = "failed" if error else "done"
+                job.finished = time.time()
+                self._stats[job.status] += 1
+                metrics.inc("image_jobs_total", job.status)
+                if error:
+                    # Let the next turn with this prompt try again
+                    self._jobs.pop(job.id, None)
+                else:
+                    self._finished[job.id] = job
+                    while len(self._finished) > self.max_results:
+                        expired, _ = self._finished.popitem(last=False)
+                        self._jobs.pop(expired, None)
+                notify = [(callback, self._describe(context, turn))
+                          for context, turn, callback in self._watchers.pop(job.id, [])]
+                self._cond.notify_all()
+            for callback, status in notify:
+                try:
+                    callback(status)
+                except Exception as e:
+                    print(f"[DEBUG] Error in image job callback: {e}")
@@ -1,18 +1,38 @@
 # main.py
 
+import json
+import math
+import os
+import queue
 import threading
 import argparse
-from flask import Flask, request, jsonify
+import gzip
+import time
+import uuid
+import zlib
+from flask import Flask, Response, g, request, jsonify, send_from_directory
 
 from conversation_manager import ConversationManager
-from manager_instance import manager  # Import the shared manager instance
+from manager_instance import manager, image_jobs  # Import the shared manager instance
 from console_commands import console_mode
 from game_logic import initialize_game, process_game_turn
+from scheduler import OverloadedError
+from metrics import metrics
+from traffic import TrafficRecorder
+from profiling import profiler
 
 # Flask server configuration
 FLASK_HOST = '127.0.0.1'  # Default host
 FLASK_PORT = 5000         # Default port
 
+# Opt-in request log for benchmarks/replay.py, rotated at TRAFFIC_LOG_MAX_BYTES
+TRAFFIC_LOG = os.getenv('TRAFFIC_LOG')
+traffic = TrafficRecorder(
+    TRAFFIC_LOG,
+    max_bytes=int(os.getenv('TRAFFIC_LOG_MAX_BYTES', 10 * 1024 * 1024)),
+    backups=int(os.getenv('TRAFFIC_LOG_BACKUPS', 5))
+) if TRAFFIC_LOG else None
+
 app = Flask(__name__)
 
 def create_route(route, methods, func, endpoint=None):
@@ -26,12 +46,187 @@ def create_route(route, methods, func, endpoint=None):
             return jsonify(func(**data))
     return wrapper
 
+@app.before_request
+def start_timer():
+    if metrics.enabled or traffic:
+        g.request_started = time.perf_counter()
+        # Wall-clock arrival, so replays keep the original request spacing
+        g.request_arrived = time.time()
+
+@app.after_request
+def record_latency(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        if metrics.enabled:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            metrics.observe("http_request_seconds", elapsed, route, request.method, str(response.status_code))
+        if traffic:
+            traffic.record(request.method, request.full_path.rstrip('?'), request.get_json(silent=True),
+                           response.status_code, elapsed, response.headers.get('X-Request-Id'),
+                           arrived=g.pop('request_arrived', None))
+    return response
+
+@app.errorhandler(OverloadedError)
+def overloaded(error):
+    response = jsonify({"success": False, "message": str(error)})
+    return response, error.status, {"Retry-After": str(math.ceil(error.retry_after))}
+
 # Register API routes
 create_route('/create_context', ['POST'], manager.create_context)
-create_route('/list_contexts', ['GET'], manager.list_contexts)
 create_route('/delete_context', ['POST'], manager.delete_context)
-create_route('/send_prompt', ['POST'], manager.send_prompt)
 create_route('/copy_context', ['POST'], manager.copy_context)
+create_route('/scheduler_stats', ['GET'], manager.scheduler.stats)
+create_route('/cancel', ['POST'], manager.cancel_request)
+create_route('/request_stats', ['GET'], manager.requests.stats)
+create_route('/image_stats', ['GET'], image_jobs.stats)
+create_route('/flight_stats', ['GET'], manager.flights.stats)
+create_route('/set_hedge', ['POST'], manager.set_hedge)
+create_route('/hedge_stats', ['GET'], manager.hedger.stats)
+create_route('/tool_stats', ['GET'], manager.tools.stats)
+# Admin: POST {"enabled": true, "sample_every": 20} or {"enabled": true, "context": "name", "format": "collapsed"}
+create_route('/profiler', ['GET'], profiler.status)
+create_route('/profiler', ['POST'], profiler.configure)
+
+@app.route('/profiler/files/<path:filename>', methods=['GET'])
+def profile_file(filename):
+    return send_from_directory(os.path.abspath(profiler.output_dir), filename, as_attachment=True)
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    scheduler_stats = manager.scheduler.stats()
+    body = metrics.render()
+    body += metrics.render_gauge("scheduler_queue_depth", "Requests waiting for a provider slot.", "service",
+                                 {service: stats["queue_depth"] for service, stats in scheduler_stats.items()})
+    body += metrics.render_gauge("scheduler_running", "Requests holding a provider slot.", "service",
+                                 {service: stats["running"] for service, stats in scheduler_stats.items()})
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+def stream_ndjson(run, request_id: str) -> Response:
+    """Stream `run(on_chunk)` as NDJSON: {"chunk": ...} lines, then the result dict.
+
+    The call runs on its own thread. If the client hangs up, the server closes
+    this generator on the next write and the upstream request is cancelled.
+    """
+    chunks = queue.Queue()
+
+    def worker():
+        try:
+            result = run(chunks.put)
+        except OverloadedError as e:
+            result = {"success": False, "message": str(e), "retry_after": math.ceil(e.retry_after)}
+        except Exception as e:
+            result = {"success": False, "message": f"Error: {e}"}
+        chunks.put(dict(result, request_id=request_id))
+
+    def generate():
+        finished = False
+        try:
+            while not finished:
+                item = chunks.get()
+                finished = isinstance(item, dict)
+                yield json.dumps(item if finished else {"chunk": item}) + "\n"
+        finally:
+            if not finished:
+                manager.cancel_request(request_id)
+
+    threading.Thread(target=worker, daemon=True).start()
+    return Response(generate(), mimetype='application/x-ndjson', headers={"X-Request-Id": request_id})
+
+def idempotency_key(data) -> str:
+    # A client that retries with the same Idempotency-Key gets the first attempt's result.
+    # Pops from `data`, so pass a copy of request.json: the traffic log records the original.
+    key = data.pop('idempotency_key', None)
+    return request.headers.get('Idempotency-Key') or key
+
+@app.route('/send_prompt', methods=['POST'])
+def send_prompt():
+    data = dict(request.json or {})
+    return jsonify(manager.send_prompt(idempotency_key=idempotency_key(data), **data))
+
+@app.route('/send_prompt_stream', methods=['POST'])
+def send_prompt_stream():
+    data = dict(request.json or {})
+    request_id = data.pop('request_id', None) or request.headers.get('X-Request-Id') or uuid.uuid4().hex
+    key = idempotency_key(data)
+    return stream_ndjson(
+        lambda on_chunk: manager.send_prompt(request_id=request_id, on_chunk=on_chunk, stream=True,
+                                             idempotency_key=key, **data),
+        request_id)
+
+# Page size for /list_contexts when the client does not pass ?limit=
+LIST_PAGE_SIZE = 100
+LIST_MAX_PAGE_SIZE = 1000
+
+@app.route('/list_contexts', methods=['GET'])
+def list_contexts():
+    # ?service=groq&model=...&sort=name|last_active&order=asc|desc&limit=100&cursor=<next_cursor>
+    limit = request.args.get('limit', LIST_PAGE_SIZE, type=int)
+    if limit < 1:
+        return jsonify({"success": False, "message": "limit must be a positive integer."}), 400
+    result = manager.list_contexts(
+        service=request.args.get('service'),
+        model=request.args.get('model'),
+        sort=request.args.get('sort', 'name'),
+        order=request.args.get('order'),
+        limit=min(limit, LIST_MAX_PAGE_SIZE),
+        cursor=request.args.get('cursor')
+    )
+    return jsonify(result), 200 if result["success"] else 400
+
+# Responses from /get_history larger than this are gzipped for clients that accept it
+GZIP_MIN_BYTES = 4096
+HISTORY_PAGE_SIZE = 100
+HISTORY_MAX_PAGE_SIZE = 1000
+
+def accepts_gzip() -> bool:
+    return request.accept_encodings['gzip'] > 0
+
+def gzip_ndjson(lines):
+    # One gzip stream, flushed after each batch so the client can decode as it goes
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) == 200:
+            yield compressor.compress("".join(batch).encode()) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            batch = []
+    yield compressor.compress("".join(batch).encode()) + compressor.flush()
+
+@app.route('/get_history', methods=['GET'])
+def get_history():
+    # ?name=<context>&offset=0&limit=100 | &since=<message id> | &tail=10, or &format=ndjson for the whole history
+    name = request.args.get('name')
+    if not name:
+        return jsonify({"success": False, "message": "Missing context name."}), 400
+    try:
+        params = {key: int(request.args[key]) for key in ('offset', 'limit', 'since', 'tail') if key in request.args}
+    except ValueError:
+        return jsonify({"success": False, "message": "offset, limit, since and tail must be integers."}), 400
+
+    if request.args.get('format') == 'ndjson':
+        exists = manager.get_history(name, tail=0)
+        if not exists["success"]:
+            return jsonify(exists), 404
+        lines = (json.dumps(message) + "\n" for message in manager.iter_history(name))
+        if accepts_gzip():
+            return Response(gzip_ndjson(lines), mimetype='application/x-ndjson',
+                            headers={"Content-Encoding": "gzip", "Vary": "Accept-Encoding"})
+        return Response(lines, mimetype='application/x-ndjson', headers={"Vary": "Accept-Encoding"})
+
+    if 'tail' in params:
+        params['tail'] = min(params['tail'], HISTORY_MAX_PAGE_SIZE)
+    else:
+        params['limit'] = min(params.get('limit', HISTORY_PAGE_SIZE), HISTORY_MAX_PAGE_SIZE)
+    result = manager.get_history(name, **params)
+    if not result["success"]:
+        return jsonify(result), 404 if result["message"].endswith("does not exist.") else 400
+    body = json.dumps(result).encode()
+    headers = {"Vary": "Accept-Encoding"}
+    if len(body) >= GZIP_MIN_BYTES and accepts_gzip():
+        body = gzip.compress(body, compresslevel=6)
+        headers["Content-Encoding"] = "gzip"
+    return Response(body, mimetype='application/json', headers=headers)
 
 @app.route('/list_models', methods=['GET'])
 def list_models():
@@ -50,10 +245,10 @@ def list_models():
 def start_game():
     data = request.json
     context_name = data.get('context_name')
-    if not context_name or context_name not in manager.contexts:
+    context = manager.get_context(context_name) if context_name else None
+    if context is None:
         return jsonify({"error": "Invalid or missing context name"}), 400
-    
-    context = manager.contexts[context_name]
+
     initial_state = initialize_game(context)
     return jsonify({"initial_state": initial_state})
 
@@ -63,14 +258,32 @@ def game_turn():
     context_name = data.get('context_name')
     user_input = data.get('user_input')
     
-    if not context_name or context_name not in manager.contexts:
+    context = manager.get_context(context_name) if context_name else None
+    if context is None:
         return jsonify({"error": "Invalid or missing context name"}), 400
     if not user_input:
         return jsonify({"error": "Missing user input"}), 400
-    
-    context = manager.contexts[context_name]
-    game_response = process_game_turn(context, user_input)
-    return jsonify({"game_response": game_response})
+
+    request_id = data.get('request_id') or request.headers.get('X-Request-Id')
+    game_response = process_game_turn(context, user_input, request_id,
+                                      idempotency_key=request.headers.get('Idempotency-Key') or data.get('idempotency_key'))
+    # This turn's image job is keyed by its reply's id; a failed turn has none
+    image = image_jobs.status(context_name, len(context.history) - 1)
+    return jsonify({"game_response": game_response, "image": image if image["success"] else None})
+
+# Longest /image_status long-poll, in seconds
+IMAGE_MAX_WAIT = 60
+
+@app.route('/image_status', methods=['GET'])
+def image_status():
+    # ?context=<name>&turn=<message id>&wait=<seconds>; without turn, the context's latest image
+    context_name = request.args.get('context')
+    if not context_name:
+        return jsonify({"success": False, "message": "Missing context name."}), 400
+    turn = request.args.get('turn', type=int)
+    wait = min(request.args.get('wait', 0, type=float), IMAGE_MAX_WAIT)
+    result = image_jobs.wait(context_name, turn, wait) if wait > 0 else image_jobs.status(context_name, turn)
+    return jsonify(result), 200 if result["success"] else 404
 
 def run_server():
     app.run(host=FLASK_HOST, port=FLASK_PORT, debug=False)
@@ -79,11 +292,17 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Conversation Manager and Game')
     parser.add_argument('--port', type=int, default=FLASK_PORT, help='Port number for the server')
     parser.add_argument('--host', type=str, default=FLASK_HOST, help='Host for the Flask server')
+    parser.add_argument('--ws-port', type=int, default=int(os.getenv('WS_PORT', 0)),
+                        help='Port for WebSocket game sessions (needs the websockets package; 0 disables them)')
     args = parser.parse_args()
 
     FLASK_PORT = args.port
     FLASK_HOST = args.host
 
+    if args.ws_port:
+        from game_sessions import start_game_server
+        start_game_server(FLASK_HOST, args.ws_port)
+
     # Start the Flask server in a separate thread
     flask_thread = threading.Thread(target=run_server, daemon=True)
     flask_thread.start()
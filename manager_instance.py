@@ -1,8 +1,12 @@
 # manager_instance.py
 
 import os
+import threading
 from dotenv import load_dotenv
 from conversation_manager import ConversationManager
+from scheduler import Scheduler
+from hedging import Hedger
+from image_jobs import HTTPImageBackend, ImageJobQueue, StubImageBackend
 
 # Load environment variables
 load_dotenv()
@@ -12,13 +16,71 @@ OLLAMA_HOST = os.getenv('OLLAMA_HOST', 'http://localhost')
 OLLAMA_PORT = int(os.getenv('OLLAMA_PORT', 11434))
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 CEREBRAS_API_KEY = os.getenv("CEREBRAS_API_KEY")
+# Point the SDKs at another endpoint, e.g. the fake servers in benchmarks/fake_servers.py
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL")
+CEREBRAS_BASE_URL = os.getenv("CEREBRAS_BASE_URL")
+# 'sqlite:<path>' shares contexts between worker processes, e.g. for gunicorn -w 4 main:app.
+# Idempotency-Key results are shared through it as well; identical turns still
+# in progress are only coalesced within each worker.
+CONTEXT_DB = os.getenv('CONTEXT_DB', 'all_contexts.json')
+
+def parse_limits(value: str, cast=int) -> dict:
+    # "groq=8,ollama=2" -> {"groq": 8, "ollama": 2}; an entry without a key is stored under ""
+    limits = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        key, _, limit = item.rpartition('=')
+        limits[key.strip()] = cast(limit.strip())
+    return limits
+
+def parse_keep_alive(value: str):
+    # Ollama takes a number of seconds or a duration string like "30m"; -1 keeps the model loaded
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+# Concurrent upstream calls allowed per provider and per model, and the queue size per provider
+PROVIDER_CONCURRENCY = parse_limits(os.getenv('PROVIDER_CONCURRENCY', ''))
+MODEL_CONCURRENCY = parse_limits(os.getenv('MODEL_CONCURRENCY', ''))
+MAX_QUEUE = int(os.getenv('MAX_QUEUE', 64))
+# Scene images: 'stub', or the URL of an Automatic1111-compatible Stable Diffusion API
+IMAGE_BACKEND = os.getenv('IMAGE_BACKEND', 'stub')
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+IMAGE_QUEUE = int(os.getenv('IMAGE_QUEUE', 32))
+# How long Ollama keeps models loaded between turns, e.g. "30m,llama3.1:70b=-1"
+OLLAMA_KEEP_ALIVE = parse_limits(os.getenv('OLLAMA_KEEP_ALIVE', ''), cast=parse_keep_alive)
+# Models loaded in the background at startup, e.g. "llama3.1:8b,mistral"
+OLLAMA_PRELOAD = [model.strip() for model in os.getenv('OLLAMA_PRELOAD', '').split(',') if model.strip()]
+# Hedged contexts send a backup request once the primary is slower than this quantile of its
+# recent time to first output; at most HEDGE_MAX_RATE of requests are hedged
+HEDGE_QUANTILE = float(os.getenv('HEDGE_QUANTILE', 0.95))
+HEDGE_MAX_RATE = float(os.getenv('HEDGE_MAX_RATE', 0.2))
+HEDGE_DEFAULT_DELAY = float(os.getenv('HEDGE_DEFAULT_DELAY', 1.0))
+# Per-turn limits for contexts with use_tools on
+TOOL_MAX_ROUNDS = int(os.getenv('TOOL_MAX_ROUNDS', ConversationManager.MAX_TOOL_ROUNDS))
+TOOL_TURN_SECONDS = float(os.getenv('TOOL_TURN_SECONDS', ConversationManager.TOOL_TURN_SECONDS))
 
 # Create a shared instance of ConversationManager
 manager = ConversationManager(
     groq_api_key=GROQ_API_KEY,
     ollama_host=OLLAMA_HOST,
     ollama_port=OLLAMA_PORT,
-    cerebras_api_key=CEREBRAS_API_KEY
+    cerebras_api_key=CEREBRAS_API_KEY,
+    db_path=CONTEXT_DB,
+    scheduler=Scheduler(PROVIDER_CONCURRENCY, MODEL_CONCURRENCY, max_queue=MAX_QUEUE),
+    groq_base_url=GROQ_BASE_URL,
+    cerebras_base_url=CEREBRAS_BASE_URL,
+    ollama_keep_alive=OLLAMA_KEEP_ALIVE,
+    hedger=Hedger(quantile=HEDGE_QUANTILE, default_delay=HEDGE_DEFAULT_DELAY, max_rate=HEDGE_MAX_RATE)
+)
+manager.MAX_TOOL_ROUNDS = TOOL_MAX_ROUNDS
+manager.TOOL_TURN_SECONDS = TOOL_TURN_SECONDS
+
+# Background queue for the images described in game turns
+image_jobs = ImageJobQueue(
+    backend=StubImageBackend() if IMAGE_BACKEND == 'stub' else HTTPImageBackend(IMAGE_BACKEND),
+    workers=IMAGE_WORKERS,
+    max_queue=IMAGE_QUEUE
 )
 
 # List of available Groq models
@@ -46,4 +108,8 @@ try:
 except Exception as e:
     print(f"Warning: Could not connect to Ollama server. Error: {e}")
 
+if OLLAMA_PRELOAD:
+    threading.Thread(target=manager.ollama_client.preload, args=(OLLAMA_PRELOAD,),
+                     name="ollama-preload", daemon=True).start()
+
 print("ConversationManager instance created and configured.")
\ No newline at end of file
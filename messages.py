@@ -0,0 +1,48 @@
+# messages.py
+
+import sys
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator
+
+_ROLES = {role: sys.intern(role) for role in ("system", "user", "assistant", "tool")}
+
+def intern_role(role: str) -> str:
+    return _ROLES.get(role) or sys.intern(role)
+
+class Message(Mapping):
+    """A chat message that reads like the {"role", "content"} dict the SDKs expect.
+
+    Messages are never mutated once created, so histories can share them and
+    the history list itself can be handed to the provider clients as is.
+    """
+    __slots__ = ("role", "content")
+
+    def __init__(self, role: str, content: str):
+        self.role = intern_role(role)
+        self.content = content
+
+    def __getitem__(self, key: str) -> Any:
+        if key == "role":
+            return self.role
+        if key == "content":
+            return self.content
+        raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        yield "role"
+        yield "content"
+
+    def __len__(self) -> int:
+        return 2
+
+    def __repr__(self) -> str:
+        return f"Message(role={self.role!r}, content={self.content!r})"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"role": self.role, "content": self.content}
+
+    @classmethod
+    def from_dict(cls, data: Mapping) -> 'Message':
+        if isinstance(data, cls):
+            return data
+        return cls(data["role"], data["content"])
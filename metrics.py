@@ -0,0 +1,183 @@
+# metrics.py
+
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+RATE_BUCKETS = (5, 10, 25, 50, 100, 200, 400, 800, 1600, 3200)
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...], buckets: Iterable[float]):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (+Inf last), sum, count]
+        self.series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def quantile(self, labels: Tuple[str, ...], q: float) -> Optional[float]:
+        """Estimate a quantile by interpolating inside the bucket it falls in."""
+        series = self.series.get(labels)
+        if not series or not series[2]:
+            return None
+        rank = q * series[2]
+        seen = 0
+        for i, count in enumerate(series[0]):
+            if count and seen + count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else lower
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in sorted(self.series.items()):
+            base = _labels(self.labelnames, labels)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                lines.append(f'{self.name}_bucket{{{base}{"," if base else ""}le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{base}}} {total}")
+            lines.append(f"{self.name}_count{{{base}}} {count}")
+        return lines
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.series: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, labels: Tuple[str, ...], amount: float = 1):
+        self.series[labels] = self.series.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.series.items()):
+            lines.append(f"{self.name}{{{_labels(self.labelnames, labels)}}} {value}")
+        return lines
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+class Metrics:
+    """Process-wide histograms and counters in Prometheus text format.
+
+    When disabled every recording call returns straight away; callers that
+    need timestamps check `metrics.enabled` before taking them.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, object] = {}
+        model = ("service", "model")
+        self._histogram("llm_queue_seconds", "Time spent waiting for a scheduler slot.", model, LATENCY_BUCKETS)
+        self._histogram("llm_time_to_first_token_seconds", "Time from request start to the first token.", model, LATENCY_BUCKETS)
+        self._histogram("llm_generation_seconds", "Total upstream generation time.", model, LATENCY_BUCKETS)
+        self._histogram("llm_tokens_per_second", "Completion tokens per second of generation.", model, RATE_BUCKETS)
+        self._histogram("llm_prompt_tokens", "Prompt tokens per request.", model, TOKEN_BUCKETS)
+        self._histogram("llm_completion_tokens", "Completion tokens per request.", model, TOKEN_BUCKETS)
+        self._counter("llm_requests_total", "Upstream generation requests.", model)
+        self._counter("llm_errors_total", "Failed upstream requests by error class.", model + ("error",))
+        self._counter("llm_cancelled_total", "Requests cancelled mid-generation.", model)
+        self._counter("llm_tokens_saved_total", "Completion tokens not generated thanks to cancellation.", model)
+        self._counter("scheduler_rejected_total", "Requests turned away by the scheduler.", ("service", "reason"))
+        self._counter("hedged_requests_total", "Generations by hedging outcome: unhedged, or the hedged leg that won.", ("outcome",))
+        self._counter("coalesced_requests_total", "Turns answered from an identical turn instead of upstream.", ("kind",))
+        self._histogram("storage_seconds", "Context store operation latency.", ("operation",), LATENCY_BUCKETS)
+        self._histogram("image_job_seconds", "Image generation time per job.", ("backend",), LATENCY_BUCKETS)
+        self._counter("image_jobs_total", "Image jobs by outcome.", ("outcome",))
+        self._histogram("tool_seconds", "Tool execution time per call.", ("tool",), LATENCY_BUCKETS)
+        self._counter("tool_calls_total", "Tool calls by outcome.", ("tool", "outcome"))
+        self._histogram("http_request_seconds", "Flask route latency.", ("route", "method", "status"), LATENCY_BUCKETS)
+
+    def _histogram(self, name: str, help_text: str, labelnames: Tuple[str, ...], buckets: Iterable[float]):
+        self._metrics[name] = Histogram(name, help_text, labelnames, buckets)
+
+    def _counter(self, name: str, help_text: str, labelnames: Tuple[str, ...]):
+        self._metrics[name] = Counter(name, help_text, labelnames)
+
+    def observe(self, name: str, value: float, *labels: str):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._metrics[name].observe(labels, value)
+
+    def inc(self, name: str, *labels: str, amount: float = 1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._metrics[name].inc(labels, amount)
+
+    @contextmanager
+    def timer(self, name: str, *labels: str):
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, *labels)
+
+    @staticmethod
+    def render_gauge(name: str, help_text: str, labelname: str, values: Dict[str, float]) -> str:
+        lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+        for label, value in sorted(values.items()):
+            lines.append(f'{name}{{{labelname}="{_escape(label)}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def render(self) -> str:
+        with self._lock:
+            lines = []
+            for metric in self._metrics.values():
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> List[Dict[str, object]]:
+        """Per service/model latency and token figures for the console."""
+        with self._lock:
+            generation = self._metrics["llm_generation_seconds"]
+            ttft = self._metrics["llm_time_to_first_token_seconds"]
+            queue = self._metrics["llm_queue_seconds"]
+            rate = self._metrics["llm_tokens_per_second"]
+            prompt = self._metrics["llm_prompt_tokens"]
+            completion = self._metrics["llm_completion_tokens"]
+            errors = self._metrics["llm_errors_total"]
+            rows = []
+            for labels, (_, total, count) in sorted(generation.series.items()):
+                rows.append({
+                    "service": labels[0],
+                    "model": labels[1],
+                    "requests": count,
+                    "errors": sum(v for k, v in errors.series.items() if k[:2] == labels),
+                    "generation_avg": total / count,
+                    "generation_p95": generation.quantile(labels, 0.95),
+                    "ttft_p50": ttft.quantile(labels, 0.5),
+                    "queue_p95": queue.quantile(labels, 0.95),
+                    "tokens_per_second_p50": rate.quantile(labels, 0.5),
+                    "prompt_tokens": prompt.series.get(labels, [None, 0])[1],
+                    "completion_tokens": completion.series.get(labels, [None, 0])[1],
+                })
+            return rows
+
+metrics = Metrics(enabled=os.getenv('METRICS_ENABLED', '1') != '0')
@@ -0,0 +1,186 @@
+# profiling.py
+
+import cProfile
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+FORMATS = ("pstats", "collapsed")
+
+class _Run:
+    __slots__ = ("kind", "context", "started", "phases", "profile", "stacks", "stop")
+
+    def __init__(self, kind: str, context: str):
+        self.kind = kind
+        self.context = context
+        self.started = time.perf_counter()
+        self.phases: List[Dict[str, Any]] = []
+        self.profile = None
+        self.stacks = None
+        self.stop = None
+
+class Profiler:
+    """Profiles selected requests and times the phases inside them.
+
+    Either every request on one context is profiled, or 1 in `sample_every`
+    of all requests. Each profiled request writes to `output_dir`:
+      <name>.prof       cProfile stats (format "pstats"; python -m pstats, snakeviz)
+      <name>.collapsed  sampled stacks (format "collapsed"; flamegraph.pl, speedscope)
+      <name>.json       phase timeline: load, generate, upstream, parse, save, ...
+    Outside a profiled request, phase() costs one thread-local lookup.
+    """
+
+    def __init__(self, output_dir: str = 'profiles', sample_every: int = 100, context: Optional[str] = None,
+                 format: str = 'pstats', interval: float = 0.002, enabled: bool = False):
+        self.output_dir = output_dir
+        self.sample_every = sample_every
+        self.context = context
+        self.format = format
+        self.interval = interval
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        # Python 3.12+ allows only one active cProfile per process
+        self._cprofile_lock = threading.Lock()
+        self._local = threading.local()
+        self._seen = 0
+        self._profiled = 0
+        self._recent = deque(maxlen=20)
+
+    def configure(self, enabled: Optional[bool] = None, sample_every: Optional[int] = None,
+                  context: Optional[str] = None, format: Optional[str] = None) -> Dict[str, Any]:
+        """Change settings at runtime; an empty `context` goes back to sampling."""
+        if format is not None and format not in FORMATS:
+            return {"success": False, "message": f"Unknown profile format: {format}"}
+        if sample_every is not None and (not isinstance(sample_every, int) or sample_every < 1):
+            return {"success": False, "message": "sample_every must be a positive integer."}
+        with self._lock:
+            if sample_every is not None:
+                self.sample_every = sample_every
+                self._seen = 0
+            if context is not None:
+                self.context = context or None
+            if format is not None:
+                self.format = format
+            if enabled is not None:
+                self.enabled = bool(enabled)
+        return dict(self.status(), success=True, message="Profiler updated.")
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "sample_every": self.sample_every,
+                "context": self.context,
+                "format": self.format,
+                "output_dir": self.output_dir,
+                "profiled": self._profiled,
+                "recent": list(self._recent),
+            }
+
+    def _select(self, context_name: str) -> bool:
+        with self._lock:
+            if self.context:
+                return context_name == self.context
+            self._seen += 1
+            return self._seen % self.sample_every == 0
+
+    @contextmanager
+    def profile(self, kind: str, context_name: str):
+        """Profile the enclosed request if it is selected; nested calls join the outer profile."""
+        if not self.enabled or getattr(self._local, 'run', None) is not None or not self._select(context_name):
+            yield
+            return
+        run = _Run(kind, context_name)
+        self._local.run = run
+        if self.format == 'collapsed':
+            self._start_sampler(run)
+        elif self._cprofile_lock.acquire(blocking=False):
+            run.profile = cProfile.Profile()
+            run.profile.enable()
+        # else another request holds cProfile; this one still gets its phase timings
+        try:
+            yield
+        finally:
+            self._local.run = None
+            if run.profile is not None:
+                run.profile.disable()
+                self._cprofile_lock.release()
+            if run.stop is not None:
+                run.stop.set()
+            self._write(run, time.perf_counter() - run.started)
+
+    @contextmanager
+    def phase(self, name: str):
+        run = getattr(self._local, 'run', None)
+        if run is None:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            run.phases.append({"phase": name, "start_ms": round((started - run.started) * 1000, 3),
+                               "ms": round((time.perf_counter() - started) * 1000, 3)})
+
+    def _start_sampler(self, run: _Run):
+        thread_id = threading.get_ident()
+        run.stacks = Counter()
+        run.stop = threading.Event()
+
+        def sample():
+            while not run.stop.wait(self.interval):
+                frame = sys._current_frames().get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if stack:
+                    run.stacks[";".join(reversed(stack))] += 1
+
+        threading.Thread(target=sample, daemon=True).start()
+
+    def _write(self, run: _Run, elapsed: float):
+        with self._lock:
+            self._profiled += 1
+            seq = self._profiled
+        context = re.sub(r'[^A-Za-z0-9_.-]', '_', run.context or '')[:40]
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{run.kind}-{context}-{seq}"
+        base = os.path.join(self.output_dir, name)
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            files = [name + ".json"]
+            if run.profile is not None:
+                run.profile.dump_stats(base + ".prof")
+                files.append(name + ".prof")
+            if run.stacks is not None:
+                with open(base + ".collapsed", 'w') as f:
+                    for stack, count in run.stacks.items():
+                        f.write(f"{stack} {count}\n")
+                files.append(name + ".collapsed")
+            with open(base + ".json", 'w') as f:
+                json.dump({
+                    "kind": run.kind,
+                    "context": run.context,
+                    "total_ms": round(elapsed * 1000, 3),
+                    "phases": sorted(run.phases, key=lambda p: p["start_ms"]),
+                    "files": files,
+                }, f, indent=2)
+            with self._lock:
+                self._recent.extend(files)
+        except Exception as e:
+            print(f"[DEBUG] Error writing profile {name}: {e}")
+
+profiler = Profiler(
+    output_dir=os.getenv('PROFILE_DIR', 'profiles'),
+    sample_every=int(os.getenv('PROFILE_SAMPLE_EVERY', 100)),
+    context=os.getenv('PROFILE_CONTEXT') or None,
+    format=os.getenv('PROFILE_FORMAT', 'pstats'),
+    enabled=os.getenv('PROFILE_ENABLED', '0') == '1'
+)
@@ -0,0 +1,154 @@
+# scheduler.py
+
+import bisect
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+from metrics import metrics
+
+# Lower rank runs first.
+PRIORITIES = {"interactive": 0, "normal": 1, "batch": 2}
+
+# Seconds a request may wait in the queue before it is turned away.
+DEFAULT_DEADLINES = {"interactive": 20.0, "normal": 60.0, "batch": 300.0}
+
+DEFAULT_PROVIDER_LIMITS = {"groq": 8, "cerebras": 8, "ollama": 2}
+
+class OverloadedError(Exception):
+    """Raised when a request is not admitted. `status` is the HTTP status to answer with."""
+
+    def __init__(self, message: str, retry_after: float, status: int = 503):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.status = status
+
+class _Waiter:
+    __slots__ = ("rank", "seq", "model")
+
+    def __init__(self, rank: int, seq: int, model: str):
+        self.rank = rank
+        self.seq = seq
+        self.model = model
+
+    def __lt__(self, other: '_Waiter') -> bool:
+        return (self.rank, self.seq) < (other.rank, other.seq)
+
+class Scheduler:
+    """Admission control in front of the provider clients.
+
+    Each provider, and optionally each model, has a concurrency limit. Requests
+    over the limit wait in a per-provider queue ordered by priority class, then
+    arrival. A full queue is rejected at once (429); a request still queued at
+    its deadline is rejected (503). Both carry a Retry-After estimate.
+    """
+
+    def __init__(self, provider_limits: Optional[Dict[str, int]] = None, model_limits: Optional[Dict[str, int]] = None,
+                 max_queue: int = 64, deadlines: Optional[Dict[str, float]] = None):
+        self.provider_limits = dict(DEFAULT_PROVIDER_LIMITS, **(provider_limits or {}))
+        self.model_limits = dict(model_limits or {})
+        self.max_queue = max_queue
+        self.deadlines = dict(DEFAULT_DEADLINES, **(deadlines or {}))
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._queues: Dict[str, List[_Waiter]] = {}
+        self._running: Dict[Any, int] = {}
+        # Moving average of how long an admitted call holds its slot, for Retry-After.
+        self._service_time: Dict[str, float] = {}
+        self._stats: Dict[str, Dict[str, Any]] = {}
+
+    def run(self, service: str, model: str, fn: Callable[[], Any], priority: str = "normal",
+            deadline: Optional[float] = None) -> Any:
+        with self.slot(service, model, priority, deadline):
+            return fn()
+
+    @contextmanager
+    def slot(self, service: str, model: str, priority: str = "normal", deadline: Optional[float] = None):
+        self._admit(service, model, priority, deadline)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(service, model, time.monotonic() - started)
+
+    def _admit(self, service: str, model: str, priority: str, deadline: Optional[float]):
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {priority}")
+        deadline = self.deadlines[priority] if deadline is None else deadline
+        with self._cond:
+            stats = self._stats_for(service)
+            queue = self._queues.setdefault(service, [])
+            waiter = _Waiter(PRIORITIES[priority], next(self._seq), model)
+            bisect.insort(queue, waiter)
+            enqueued = time.monotonic()
+            try:
+                if not self._can_start(service, waiter) and len(queue) > self.max_queue:
+                    stats["rejected_queue_full"] += 1
+                    metrics.inc("scheduler_rejected_total", service, "queue_full")
+                    raise OverloadedError(f"Too many queued requests for {service}.", self._retry_after(service), status=429)
+                while not self._can_start(service, waiter):
+                    remaining = enqueued + deadline - time.monotonic()
+                    if remaining <= 0:
+                        stats["rejected_deadline"] += 1
+                        metrics.inc("scheduler_rejected_total", service, "deadline")
+                        raise OverloadedError(f"Timed out waiting for a {service} slot.", self._retry_after(service))
+                    self._cond.wait(remaining)
+            finally:
+                queue.remove(waiter)
+                # The head of the queue changed; let the next waiter re-check.
+                self._cond.notify_all()
+
+            waited = time.monotonic() - enqueued
+            stats["admitted"] += 1
+            stats["wait_seconds_total"] += waited
+            stats["wait_seconds_max"] = max(stats["wait_seconds_max"], waited)
+            metrics.observe("llm_queue_seconds", waited, service, model)
+            self._running[service] = self._running.get(service, 0) + 1
+            self._running[(service, model)] = self._running.get((service, model), 0) + 1
+
+    def _release(self, service: str, model: str, held: float):
+        with self._cond:
+            self._running[service] -= 1
+            self._running[(service, model)] -= 1
+            previous = self._service_time.get(service)
+            self._service_time[service] = held if previous is None else 0.8 * previous + 0.2 * held
+            self._cond.notify_all()
+
+    def _model_free(self, service: str, model: str) -> bool:
+        limit = self.model_limits.get(model)
+        return limit is None or self._running.get((service, model), 0) < limit
+
+    def _can_start(self, service: str, waiter: _Waiter) -> bool:
+        limit = self.provider_limits.get(service)
+        if limit is not None and self._running.get(service, 0) >= limit:
+            return False
+        # The first queued request whose model has room goes next.
+        for other in self._queues[service]:
+            if self._model_free(service, other.model):
+                return other is waiter
+        return False
+
+    def _retry_after(self, service: str) -> float:
+        limit = self.provider_limits.get(service) or 1
+        depth = len(self._queues.get(service, ()))
+        return max(1.0, self._service_time.get(service, 1.0) * (depth + 1) / limit)
+
+    def _stats_for(self, service: str) -> Dict[str, Any]:
+        if service not in self._stats:
+            self._stats[service] = {"admitted": 0, "rejected_queue_full": 0, "rejected_deadline": 0,
+                                    "wait_seconds_total": 0.0, "wait_seconds_max": 0.0}
+        return self._stats[service]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                service: dict(
+                    stats,
+                    queue_depth=len(self._queues.get(service, ())),
+                    running=self._running.get(service, 0),
+                    limit=self.provider_limits.get(service),
+                    wait_seconds_avg=stats["wait_seconds_total"] / stats["admitted"] if stats["admitted"] else 0.0,
+                )
+                for service, stats in self._stats.items()
+            }
@@ -0,0 +1,117 @@
+# singleflight.py
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+from cancellation import CancelToken, GenerationCancelled
+
+class _Flight:
+    __slots__ = ("done", "result", "error", "waiters", "token", "attached", "wakes")
+
+    def __init__(self, token: CancelToken):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+        # The call's own token, cancelled once every attached caller has left
+        self.token = token
+        self.attached = 1
+        self.wakes: List[threading.Event] = []
+
+class SingleFlight:
+    """Runs one call per key at a time; callers that arrive while it runs get its result.
+
+    Results that `remember` accepts are also kept for `ttl` seconds (the last
+    `max_results` of them), so callers that arrive after the call finished get
+    them too. Exceptions are raised to every caller but never remembered, so a
+    retry after a failure runs the call again.
+
+    The call runs under a cancel token of its own, not any caller's. A caller
+    whose token is cancelled leaves: a waiting caller gets GenerationCancelled
+    straight away, and the first caller's thread carries on with the call for
+    the others. The call itself is cancelled only once every caller has left.
+    """
+
+    def __init__(self, ttl: float = 600.0, max_results: int = 1024):
+        self.ttl = ttl
+        self.max_results = max_results
+        self._lock = threading.Lock()
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._results: OrderedDict = OrderedDict()
+        self._stats = {"calls": 0, "coalesced": 0, "replayed": 0, "left": 0}
+
+    def do(self, key: Hashable, fn: Callable[[CancelToken], Any], remember: Optional[Callable[[Any], bool]] = None,
+           token: Optional[CancelToken] = None) -> Tuple[Any, bool]:
+        """Return fn(call_token)'s result, or that of the same key's call in progress, and whether it was shared.
+
+        `token` is this caller's; cancelling it detaches the caller from the call.
+        """
+        with self._lock:
+            remembered = self._results.get(key)
+            if remembered is not None:
+                expires, result = remembered
+                if expires > time.monotonic():
+                    self._stats["replayed"] += 1
+                    return result, True
+                del self._results[key]
+            flight = self._flights.get(key)
+            leader = flight is None
+            wake = None
+            if leader:
+                flight = self._flights[key] = _Flight(CancelToken(token.request_id if token else uuid.uuid4().hex))
+                self._stats["calls"] += 1
+            else:
+                flight.waiters += 1
+                flight.attached += 1
+                wake = threading.Event()
+                flight.wakes.append(wake)
+                self._stats["coalesced"] += 1
+        if token is not None:
+            token.bind(lambda: self._leave(key, flight, wake))
+        if not leader:
+            wake.wait()
+            if not flight.done.is_set():
+                raise GenerationCancelled("", 0, 0)
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            flight.result = fn(flight.token)
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                if remember is not None and flight.error is None and remember(flight.result):
+                    self._results[key] = (time.monotonic() + self.ttl, flight.result)
+                    while len(self._results) > self.max_results:
+                        self._results.popitem(last=False)
+                flight.done.set()
+                wakes = flight.wakes
+            for wake in wakes:
+                wake.set()
+        return flight.result, False
+
+    def _leave(self, key: Hashable, flight: _Flight, wake: Optional[threading.Event]):
+        with self._lock:
+            if flight.done.is_set():
+                return
+            flight.attached -= 1
+            self._stats["left"] += 1
+            last = flight.attached == 0
+            if last and self._flights.get(key) is flight:
+                # Later callers start a new call rather than join a cancelled one
+                del self._flights[key]
+        if wake is not None:
+            wake.set()
+        if last:
+            flight.token.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats, in_flight=len(self._flights), remembered=len(self._results))
@@ -0,0 +1,512 @@
+# storage.py
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from tinydb import TinyDB
+from messages import Message
+from context_index import ORDERS, SORTS, decode_cursor, encode_cursor, preview
+
+def content_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+def open_store(location: str):
+    """Return the store for a location: 'sqlite:<path>' for the shared SQLite store, else a TinyDB file."""
+    if location.startswith('sqlite:'):
+        return SQLiteContextStore(location[len('sqlite:'):])
+    return ContextStore(location)
+
+class VersionConflict(Exception):
+    """Raised when a context was changed by someone else since it was loaded."""
+
+    def __init__(self, name: str, version: Optional[int]):
+        super().__init__(f"Context '{name}' is at version {version}.")
+        self.name = name
+        self.version = version
+
+def _shared_text(shared: Dict[Any, Any], digest: str, content: str) -> str:
+    # One string per distinct body for everything loaded together, system
+    # prompts included; the table goes away with the load.
+    return shared.setdefault(digest, content)
+
+def _shared_message(shared: Dict[Any, Any], role: str, digest: str, content: str) -> Message:
+    # Contexts that reference the same body get the same Message object.
+    message = shared.get((role, digest))
+    if message is None:
+        message = shared[(role, digest)] = Message(role, _shared_text(shared, digest, content))
+    return message
+
+class ContextStore:
+    """TinyDB persistence that keeps each distinct message body once.
+
+    Context records reference message bodies by content hash:
+        contexts: {"name", ..., "system_prompt": hash, "history": [[role, hash], ...]}
+        messages: {"hash", "content"}
+    Reference counts are rebuilt from the context records on load and kept in
+    memory; a body is removed once no context references it.
+
+    The file is owned by a single process; use SQLiteContextStore to share
+    contexts between workers.
+    """
+    shared = False
+
+    def __init__(self, path: str = 'all_contexts.json'):
+        self.db = TinyDB(path)
+        self.contexts = self.db.table('contexts')
+        self.messages = self.db.table('messages')
+        self._refs: Dict[str, List[str]] = {}
+        self._counts: Dict[str, int] = {}
+        self._doc_ids: Dict[str, int] = {}
+        self._context_ids: Dict[str, int] = {}
+        self._versions: Dict[str, int] = {}
+
+    def load_all(self) -> List[Dict[str, Any]]:
+        # One read of the whole file; going through table.all() would parse it once per table.
+        data = self.db.storage.read() or {}
+        if data.get('_default'):
+            self._migrate_legacy_records()
+            data = self.db.storage.read() or {}
+
+        bodies = {}
+        self._doc_ids = {}
+        for doc_id, doc in data.get('messages', {}).items():
+            bodies[doc["hash"]] = doc["content"]
+            self._doc_ids[doc["hash"]] = int(doc_id)
+
+        records = []
+        shared: Dict[Any, Any] = {}
+        self._refs = {}
+        self._context_ids = {}
+        for doc_id, doc in data.get('contexts', {}).items():
+            try:
+                records.append(self._resolve(doc, bodies, shared))
+            except KeyError as e:
+                print(f"Error loading context '{doc.get('name')}': missing message body {e}")
+                continue
+            self._refs[doc["name"]] = self._hashes(doc)
+            self._context_ids[doc["name"]] = int(doc_id)
+            self._versions[doc["name"]] = doc.get("version", 0)
+        self.collect_garbage()
+        return records
+
+    def save(self, record: Dict[str, Any], expected_version: Optional[int] = None) -> int:
+        """Save one context and return its new version.
+
+        With expected_version set, raises VersionConflict unless the stored
+        context is still at that version (0 meaning it does not exist yet).
+        """
+        current = self._versions.get(record["name"], 0)
+        if expected_version is not None and expected_version != current:
+            raise VersionConflict(record["name"], current)
+        record = dict(record, version=current + 1)
+        self.save_many([record])
+        return record["version"]
+
+    def save_many(self, records: Iterable[Dict[str, Any]]):
+        new_bodies: Dict[str, str] = {}
+        released: List[str] = []
+        updated: Dict[str, Dict[str, Any]] = {}
+        inserted: Dict[str, Dict[str, Any]] = {}
+        for record in records:
+            stored, hashes = self._encode(record, new_bodies)
+            self._acquire(hashes)
+            released.extend(self._release(self._refs.get(record["name"], [])))
+            self._refs[record["name"]] = hashes
+            self._versions[record["name"]] = record.get("version", 0)
+            if record["name"] in self._context_ids:
+                updated[record["name"]] = stored
+            else:
+                inserted[record["name"]] = stored
+
+        # Bodies are written before the records that reference them, so an
+        # interrupted save leaves at worst an orphan for collect_garbage.
+        self._insert_bodies(new_bodies)
+        if updated:
+            def replace(doc):
+                stored = updated[doc["name"]]
+                doc.clear()
+                doc.update(stored)
+            self.contexts.update(replace, doc_ids=[self._context_ids[name] for name in updated])
+        if inserted:
+            doc_ids = self.contexts.insert_multiple(inserted.values())
+            self._context_ids.update(zip(inserted, doc_ids))
+        self._remove_bodies(released)
+
+    def delete(self, name: str):
+        self._versions.pop(name, None)
+        doc_id = self._context_ids.pop(name, None)
+        if doc_id is not None:
+            self.contexts.remove(doc_ids=[doc_id])
+        self._remove_bodies(self._release(self._refs.pop(name, [])))
+
+    def collect_garbage(self) -> int:
+        """Drop message bodies that no context references. Returns the number removed."""
+        self._counts = {}
+        for hashes in self._refs.values():
+            self._acquire(hashes)
+        orphans = [h for h in self._doc_ids if h not in self._counts]
+        self._remove_bodies(orphans)
+        return len(orphans)
+
+    def _encode(self, record: Dict[str, Any], new_bodies: Dict[str, str]):
+        def ref(text: str) -> str:
+            digest = content_hash(text)
+            if digest not in self._doc_ids:
+                new_bodies[digest] = text
+            return digest
+
+        stored = dict(record)
+        stored["system_prompt"] = ref(record["system_prompt"])
+        stored["history"] = [[message["role"], ref(message["content"])] for message in record["history"]]
+        return stored, self._hashes(stored)
+
+    @staticmethod
+    def _hashes(stored: Dict[str, Any]) -> List[str]:
+        return [stored["system_prompt"]] + [digest for _, digest in stored["history"]]
+
+    @staticmethod
+    def _resolve(stored: Dict[str, Any], bodies: Dict[str, str], shared: Dict[Any, Any]) -> Dict[str, Any]:
+        record = dict(stored)
+        record["system_prompt"] = bodies[stored["system_prompt"]]
+        record["history"] = [_shared_message(shared, role, digest, bodies[digest]) for role, digest in stored["history"]]
+        return record
+
+    def _acquire(self, hashes: List[str]):
+        for digest in hashes:
+            self._counts[digest] = self._counts.get(digest, 0) + 1
+
+    def _release(self, hashes: List[str]) -> List[str]:
+        released = []
+        for digest in hashes:
+            count = self._counts.get(digest, 0) - 1
+            if count > 0:
+                self._counts[digest] = count
+            else:
+                self._counts.pop(digest, None)
+                released.append(digest)
+        return released
+
+    def _insert_bodies(self, new_bodies: Dict[str, str]):
+        pending = [(digest, text) for digest, text in new_bodies.items() if digest not in self._doc_ids]
+        if not pending:
+            return
+        doc_ids = self.messages.insert_multiple({"hash": digest, "content": text} for digest, text in pending)
+        for (digest, _), doc_id in zip(pending, doc_ids):
+            self._doc_ids[digest] = doc_id
+        new_bodies.clear()
+
+    def _remove_bodies(self, hashes: List[str]):
+        # A body released by one record may have been picked up again by a later one.
+        doc_ids = [self._doc_ids.pop(digest) for digest in set(hashes)
+                   if digest not in self._counts and digest in self._doc_ids]
+        if doc_ids:
+            self.messages.remove(doc_ids=doc_ids)
+
+    def _migrate_legacy_records(self):
+        # Older versions stored whole context dicts in the default table.
+        legacy = self.db.table('_default')
+        records = legacy.all()
+        self._doc_ids = {doc["hash"]: doc.doc_id for doc in self.messages.all()}
+        self._refs, self._context_ids = {}, {}
+        for doc in self.contexts.all():
+            self._refs[doc["name"]] = self._hashes(doc)
+            self._context_ids[doc["name"]] = doc.doc_id
+        self.collect_garbage()
+        self.save_many([dict(record) for record in records])
+        legacy.truncate()
+
+
+class SQLiteContextStore:
+    """SQLite persistence that several worker processes can share.
+
+    Uses the same content-addressed layout as ContextStore, with history rows
+    in their own table. Every context carries a version that is bumped on each
+    save; writers pass the version they loaded and get a VersionConflict if
+    another worker saved in between. Writes take SQLite's write lock
+    (BEGIN IMMEDIATE) and the database runs in WAL mode so readers never block.
+    """
+    shared = True
+
+    _CORE_FIELDS = ("name", "service", "model", "system_prompt", "settings", "history", "version", "last_active")
+    _SELECT_CONTEXTS = ('SELECT c.name, c.version, c.service, c.model, c.system_prompt, m.content, c.settings, c.extra, '
+                        'c.last_active '
+                        'FROM contexts c LEFT JOIN messages m ON m.hash = c.system_prompt')
+
+    def __init__(self, path: str = 'all_contexts.db'):
+        self.path = path
+        self._local = threading.local()
+        self._connection().executescript("""
+            CREATE TABLE IF NOT EXISTS messages (
+                hash TEXT PRIMARY KEY,
+                content TEXT NOT NULL
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS contexts (
+                name TEXT PRIMARY KEY,
+                version INTEGER NOT NULL,
+                service TEXT NOT NULL,
+                model TEXT NOT NULL,
+                system_prompt TEXT NOT NULL,
+                settings TEXT NOT NULL,
+                extra TEXT NOT NULL,
+                length INTEGER NOT NULL,
+                last_active REAL NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS history (
+                context TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                PRIMARY KEY (context, seq)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS history_hash ON history (hash);
+            CREATE INDEX IF NOT EXISTS contexts_prompt ON contexts (system_prompt);
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                result TEXT NOT NULL,
+                expires REAL NOT NULL
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS results_expires ON results (expires);
+        """)
+        self._migrate()
+
+    def _migrate(self):
+        db = self._connection()
+        columns = {row[1] for row in db.execute('PRAGMA table_info(contexts)')}
+        if 'last_active' not in columns:
+            # Databases written before list pages were read from SQLite kept it in extra
+            with self._transaction() as db:
+                db.execute('ALTER TABLE contexts ADD COLUMN last_active REAL NOT NULL DEFAULT 0')
+                db.execute("UPDATE contexts SET last_active = COALESCE(json_extract(extra, '$.last_active'), 0)")
+        # The keyset indexes behind page(), one per filter and sort order
+        db.executescript("""
+            CREATE INDEX IF NOT EXISTS contexts_activity ON contexts (last_active, name);
+            CREATE INDEX IF NOT EXISTS contexts_service ON contexts (service, name);
+            CREATE INDEX IF NOT EXISTS contexts_service_activity ON contexts (service, last_active, name);
+            CREATE INDEX IF NOT EXISTS contexts_model ON contexts (model, name);
+            CREATE INDEX IF NOT EXISTS contexts_model_activity ON contexts (model, last_active, name);
+        """)
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread, reopened after a fork.
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    @contextmanager
+    def _transaction(self):
+        db = self._connection()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def remembered(self, key: str) -> Optional[Any]:
+        """A result stored by remember() for `key` that has not expired yet, or None."""
+        row = self._connection().execute('SELECT result FROM results WHERE key = ? AND expires > ?',
+                                         (key, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def remember(self, key: str, result: Any, ttl: float):
+        """Keep a JSON-serializable result for `ttl` seconds, for every worker to find."""
+        now = time.time()
+        with self._transaction() as db:
+            db.execute('DELETE FROM results WHERE expires <= ?', (now,))
+            db.execute('INSERT OR REPLACE INTO results (key, result, expires) VALUES (?, ?, ?)',
+                       (key, json.dumps(result), now + ttl))
+
+    def version(self, name: str) -> Optional[int]:
+        row = self._connection().execute('SELECT version FROM contexts WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def load(self, name: str) -> Optional[Dict[str, Any]]:
+        db = self._connection()
+        db.execute('BEGIN')
+        try:
+            row = db.execute(self._SELECT_CONTEXTS + ' WHERE c.name = ?', (name,)).fetchone()
+            if row is None:
+                return None
+            history = db.execute(
+                'SELECT h.role, h.hash, m.content FROM history h JOIN messages m ON m.hash = h.hash '
+                'WHERE h.context = ? ORDER BY h.seq', (name,)).fetchall()
+        finally:
+            db.execute('COMMIT')
+        return self._record(row, history, {})
+
+    def load_all(self) -> List[Dict[str, Any]]:
+        self.collect_garbage()
+        db = self._connection()
+        db.execute('BEGIN')
+        try:
+            rows = db.execute(self._SELECT_CONTEXTS).fetchall()
+            histories: Dict[str, list] = {}
+            for context, role, digest, content in db.execute(
+                    'SELECT h.context, h.role, h.hash, m.content FROM history h JOIN messages m ON m.hash = h.hash '
+                    'ORDER BY h.context, h.seq'):
+                histories.setdefault(context, []).append((role, digest, content))
+            shared: Dict[Any, Any] = {}
+            return [self._record(row, histories.get(row[0], []), shared) for row in rows]
+        finally:
+            db.execute('COMMIT')
+
+    def history_range(self, name: str, start: Optional[int] = 0,
+                      stop: Optional[int] = None) -> Optional[Tuple[int, List[Tuple[int, str, str]]]]:
+        """Return (history length, [(seq, role, content), ...]) for a slice of one context's history.
+
+        start and stop behave like slice bounds, so start=-5 is the last five
+        messages. Only the requested rows are read. None if the context does not exist.
+        """
+        db = self._connection()
+        db.execute('BEGIN')
+        try:
+            row = db.execute('SELECT length FROM contexts WHERE name = ?', (name,)).fetchone()
+            if row is None:
+                return None
+            length = row[0]
+            start, stop, _ = slice(start, stop).indices(length)
+            rows = db.execute(
+                'SELECT h.seq, h.role, m.content FROM history h JOIN messages m ON m.hash = h.hash '
+                'WHERE h.context = ? AND h.seq >= ? AND h.seq < ? ORDER BY h.seq', (name, start, stop)).fetchall()
+        finally:
+            db.execute('COMMIT')
+        return length, rows
+
+    def page(self, service: Optional[str] = None, model: Optional[str] = None, sort: str = "name",
+             order: str = "asc", limit: Optional[int] = None, cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """ContextIndex.page answered from the contexts table, with the same cursors.
+
+        Each page is one indexed range scan of `limit` + 1 rows, however many
+        contexts the store holds.
+        """
+        if sort not in SORTS:
+            raise ValueError(f"Unknown sort: {sort}")
+        if order not in ORDERS:
+            raise ValueError(f"Unknown order: {order}")
+        after = decode_cursor(cursor, sort, order) if cursor else None
+
+        where, params = [], []
+        for column, value in (("c.service", service), ("c.model", model)):
+            if value is not None:
+                where.append(f'{column} = ?')
+                params.append(value)
+        key = 'c.name' if sort == "name" else '(c.last_active, c.name)'
+        if after is not None:
+            where.append(f'{key} {">" if order == "asc" else "<"} ' + ('?' if sort == "name" else '(?, ?)'))
+            params.extend([after] if sort == "name" else after)
+        direction = order.upper()
+        sql = ('SELECT c.name, c.service, c.model, substr(m.content, 1, 51), c.last_active '
+               'FROM contexts c LEFT JOIN messages m ON m.hash = c.system_prompt'
+               + (' WHERE ' + ' AND '.join(where) if where else '')
+               + (f' ORDER BY c.name {direction}' if sort == "name"
+                  else f' ORDER BY c.last_active {direction}, c.name {direction}'))
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit + 1)
+        rows = self._connection().execute(sql, params).fetchall()
+
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = encode_cursor(sort, order, last[0] if sort == "name" else [last[4], last[0]])
+        return [{"name": name, "service": service, "model": model, "system_prompt": preview(prompt or ""),
+                 "last_active": last_active}
+                for name, service, model, prompt, last_active in rows], next_cursor
+
+    @staticmethod
+    def _record(row, history, shared: Dict[Any, Any]) -> Dict[str, Any]:
+        name, version, service, model, prompt_hash, system_prompt, settings, extra, last_active = row
+        record = json.loads(extra)
+        record.update({
+            "name": name,
+            "service": service,
+            "model": model,
+            "system_prompt": _shared_text(shared, prompt_hash, system_prompt or ""),
+            "settings": json.loads(settings),
+            "history": [_shared_message(shared, role, digest, content) for role, digest, content in history],
+            "version": version,
+            "last_active": last_active,
+        })
+        return record
+
+    def save(self, record: Dict[str, Any], expected_version: Optional[int] = None) -> int:
+        """Save one context and return its new version.
+
+        With expected_version set, raises VersionConflict unless the stored
+        context is still at that version (0 meaning it does not exist yet).
+        Conditional saves rely on history being append-only: rows already
+        stored at the expected version are left untouched.
+        """
+        with self._transaction() as db:
+            return self._save(db, record, expected_version)
+
+    def save_many(self, records: Iterable[Dict[str, Any]]):
+        with self._transaction() as db:
+            for record in records:
+                self._save(db, record, None)
+
+    def _save(self, db, record: Dict[str, Any], expected_version: Optional[int]) -> int:
+        name = record["name"]
+        row = db.execute('SELECT version, length FROM contexts WHERE name = ?', (name,)).fetchone()
+        current, stored_length = row if row else (0, 0)
+        if expected_version is not None and expected_version != current:
+            raise VersionConflict(name, current)
+        if expected_version is None:
+            stored_length = 0
+
+        history = record["history"]
+        start = min(stored_length, len(history))
+        bodies = [(content_hash(message["content"]), message["content"]) for message in history[start:]]
+        prompt_hash = content_hash(record["system_prompt"])
+        db.executemany('INSERT OR IGNORE INTO messages (hash, content) VALUES (?, ?)',
+                       bodies + [(prompt_hash, record["system_prompt"])])
+        db.execute('DELETE FROM history WHERE context = ? AND seq >= ?', (name, start))
+        db.executemany('INSERT INTO history (context, seq, role, hash) VALUES (?, ?, ?, ?)',
+                       [(name, start + i, message["role"], digest)
+                        for i, (message, (digest, _)) in enumerate(zip(history[start:], bodies))])
+
+        extra = {key: value for key, value in record.items() if key not in self._CORE_FIELDS}
+        version = current + 1
+        db.execute('INSERT OR REPLACE INTO contexts (name, version, service, model, system_prompt, settings, extra, '
+                   'length, last_active) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                   (name, version, record["service"], record["model"], prompt_hash,
+                    json.dumps(record["settings"]), json.dumps(extra), len(history), record.get("last_active", 0.0)))
+        return version
+
+    def delete(self, name: str):
+        # Only the bodies this context referenced can have become garbage, and
+        # the history_hash and contexts_prompt indexes answer that per body.
+        with self._transaction() as db:
+            db.execute('CREATE TEMP TABLE IF NOT EXISTS released (hash TEXT PRIMARY KEY) WITHOUT ROWID')
+            db.execute('DELETE FROM released')
+            db.execute('INSERT OR IGNORE INTO released SELECT hash FROM history WHERE context = ?', (name,))
+            db.execute('INSERT OR IGNORE INTO released SELECT system_prompt FROM contexts WHERE name = ?', (name,))
+            db.execute('DELETE FROM contexts WHERE name = ?', (name,))
+            db.execute('DELETE FROM history WHERE context = ?', (name,))
+            db.execute('DELETE FROM messages WHERE hash IN (SELECT hash FROM released) '
+                       'AND NOT EXISTS (SELECT 1 FROM history h WHERE h.hash = messages.hash) '
+                       'AND NOT EXISTS (SELECT 1 FROM contexts c WHERE c.system_prompt = messages.hash)')
+            db.execute('DELETE FROM released')
+
+    def collect_garbage(self) -> int:
+        """Drop message bodies that no context references. Returns the number removed.
+
+        A full scan; delete() cleans up after itself, so this is only needed at
+        startup or after saves that rewrote history.
+        """
+        with self._transaction() as db:
+            return db.execute(
+                'DELETE FROM messages WHERE hash NOT IN (SELECT hash FROM history) '
+                'AND hash NOT IN (SELECT system_prompt FROM contexts)').rowcount
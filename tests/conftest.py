@@ -0,0 +1,8 @@
+# tests/conftest.py
+#
+# The modules live at the repository root; run with `python -m pytest tests`.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,175 @@
+# tests/test_singleflight.py
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from cancellation import CancelToken, GenerationCancelled
+from singleflight import SingleFlight
+from storage import SQLiteContextStore
+
+class Call:
+    """A call that blocks until released and records the token it ran under."""
+
+    def __init__(self, result="reply"):
+        self.result = result
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.runs = 0
+        self.token = None
+
+    def __call__(self, token):
+        self.runs += 1
+        self.token = token
+        self.started.set()
+        while not self.release.wait(0.01):
+            if token.cancelled:
+                return "cancelled"
+        return self.result
+
+def in_thread(fn, *args):
+    outcome = {}
+
+    def run():
+        try:
+            outcome["result"] = fn(*args)
+        except BaseException as e:
+            outcome["error"] = e
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread, outcome
+
+class CoalescingTests(unittest.TestCase):
+    def setUp(self):
+        self.flights = SingleFlight()
+        self.call = Call()
+
+    def start_leader(self, token=None):
+        thread, outcome = in_thread(self.flights.do, "key", self.call, None, token)
+        self.assertTrue(self.call.started.wait(2))
+        return thread, outcome
+
+    def join_follower(self, token=None):
+        thread, outcome = in_thread(self.flights.do, "key", self.call, None, token)
+        deadline = time.monotonic() + 2
+        while self.flights.stats()["coalesced"] < 1 and time.monotonic() < deadline:
+            time.sleep(0.005)
+        return thread, outcome
+
+    def test_followers_get_the_leaders_result(self):
+        leader, led = self.start_leader()
+        follower, followed = self.join_follower()
+        self.call.release.set()
+        leader.join(2)
+        follower.join(2)
+        self.assertEqual(led["result"], ("reply", False))
+        self.assertEqual(followed["result"], ("reply", True))
+        self.assertEqual(self.call.runs, 1)
+
+    def test_call_runs_under_its_own_token(self):
+        token = CancelToken("leader")
+        leader, _ = self.start_leader(token)
+        self.assertIsNot(self.call.token, token)
+        self.call.release.set()
+        leader.join(2)
+
+    def test_cancelled_follower_leaves_without_cancelling_the_call(self):
+        leader, led = self.start_leader(CancelToken("leader"))
+        token = CancelToken("follower")
+        follower, followed = self.join_follower(token)
+        token.cancel()
+        follower.join(2)
+        self.assertIsInstance(followed.get("error"), GenerationCancelled)
+        self.assertFalse(self.call.token.cancelled)
+        self.call.release.set()
+        leader.join(2)
+        self.assertEqual(led["result"], ("reply", False))
+
+    def test_cancelled_leader_keeps_the_call_for_its_followers(self):
+        token = CancelToken("leader")
+        leader, led = self.start_leader(token)
+        follower, followed = self.join_follower(CancelToken("follower"))
+        token.cancel()
+        self.assertFalse(self.call.token.cancelled)
+        self.call.release.set()
+        leader.join(2)
+        follower.join(2)
+        self.assertEqual(followed["result"], ("reply", True))
+
+    def test_call_is_cancelled_once_every_caller_has_left(self):
+        leader_token, follower_token = CancelToken("leader"), CancelToken("follower")
+        leader, led = self.start_leader(leader_token)
+        follower, followed = self.join_follower(follower_token)
+        leader_token.cancel()
+        follower_token.cancel()
+        leader.join(2)
+        follower.join(2)
+        self.assertTrue(self.call.token.cancelled)
+        self.assertEqual(led["result"], ("cancelled", False))
+        self.assertIsInstance(followed.get("error"), GenerationCancelled)
+
+    def test_caller_after_a_cancelled_call_starts_a_new_one(self):
+        token = CancelToken("leader")
+        leader, _ = self.start_leader(token)
+        token.cancel()
+        leader.join(2)
+        call = Call("second")
+        call.release.set()
+        self.assertEqual(self.flights.do("key", call), ("second", False))
+
+class RememberedResultTests(unittest.TestCase):
+    def test_accepted_result_is_replayed(self):
+        flights = SingleFlight()
+        calls = []
+        fn = lambda token: calls.append(1) or "reply"
+        self.assertEqual(flights.do("key", fn, lambda result: True), ("reply", False))
+        self.assertEqual(flights.do("key", fn, lambda result: True), ("reply", True))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flights.stats()["replayed"], 1)
+
+    def test_rejected_result_is_not_replayed(self):
+        flights = SingleFlight()
+        results = iter(["Error: upstream", "reply"])
+        remember = lambda result: not result.startswith("Error:")
+        self.assertEqual(flights.do("key", lambda token: next(results), remember), ("Error: upstream", False))
+        self.assertEqual(flights.do("key", lambda token: next(results), remember), ("reply", False))
+
+    def test_failure_is_not_replayed(self):
+        flights = SingleFlight()
+
+        def fail(token):
+            raise RuntimeError("boom")
+        with self.assertRaises(RuntimeError):
+            flights.do("key", fail, lambda result: True)
+        self.assertEqual(flights.do("key", lambda token: "reply", lambda result: True), ("reply", False))
+
+    def test_replay_expires(self):
+        flights = SingleFlight(ttl=0.05)
+        flights.do("key", lambda token: "first", lambda result: True)
+        time.sleep(0.1)
+        self.assertEqual(flights.do("key", lambda token: "second", lambda result: True), ("second", False))
+
+    def test_oldest_results_are_dropped_past_max_results(self):
+        flights = SingleFlight(max_results=2)
+        for key in ("a", "b", "c"):
+            flights.do(key, lambda token: key, lambda result: True)
+        self.assertEqual(flights.do("a", lambda token: "again", lambda result: True), ("again", False))
+        self.assertEqual(flights.do("c", lambda token: "again", lambda result: True), ("c", True))
+
+class SharedRememberedResultTests(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "contexts.db")
+
+    def test_result_is_visible_to_another_worker(self):
+        SQLiteContextStore(self.path).remember("key", {"success": True, "response": "reply"}, ttl=60)
+        self.assertEqual(SQLiteContextStore(self.path).remembered("key"), {"success": True, "response": "reply"})
+
+    def test_expired_result_is_not_returned(self):
+        store = SQLiteContextStore(self.path)
+        store.remember("key", "reply", ttl=-1)
+        self.assertIsNone(store.remembered("key"))
+
+if __name__ == "__main__":
+    unittest.main()
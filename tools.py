@@ -0,0 +1,163 @@
+# tools.py
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+from metrics import metrics
+
+@dataclass(slots=True)
+class Tool:
+    name: str
+    function: Callable[..., Any]
+    spec: Dict[str, Any]
+    pure: bool = False
+    # Results of a pure tool by its canonical JSON arguments, least recently used first
+    cache: OrderedDict = field(default_factory=OrderedDict)
+
+class ToolRegistry:
+    """Functions the models may call, and the pool their calls run on.
+
+    A reply can ask for several tools at once; run() executes them together and
+    returns their results in order. Tools registered as pure (same arguments,
+    same result) are memoized, keeping the last `cache_size` results per tool.
+    A failing tool never fails the turn: the error is handed back to the model
+    as the tool's result.
+    """
+
+    def __init__(self, workers: int = 8, cache_size: int = 256):
+        self.cache_size = cache_size
+        self._tools: Dict[str, Tool] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tool")
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def register(self, name: str, function: Callable[..., Any], description: str,
+                 parameters: Dict[str, Any], pure: bool = False):
+        spec = {"type": "function",
+                "function": {"name": name, "description": description, "parameters": parameters}}
+        with self._lock:
+            self._tools[name] = Tool(name, function, spec, pure)
+            self._stats[name] = {"calls": 0, "errors": 0, "timeouts": 0, "cache_hits": 0}
+
+    def specs(self, selected: Optional[List[Any]] = None) -> List[Dict[str, Any]]:
+        """Tool definitions to send upstream.
+
+        `selected` is a context's settings.tools: registered tool names, or full
+        definitions passed through as they are. Empty means every registered tool.
+        """
+        if not selected:
+            return [tool.spec for tool in self._tools.values()]
+        specs = []
+        for item in selected:
+            if isinstance(item, dict):
+                specs.append(item)
+            elif item in self._tools:
+                specs.append(self._tools[item].spec)
+            else:
+                print(f"[DEBUG] Unknown tool in settings: {item}")
+        return specs
+
+    def run(self, calls: List[Dict[str, Any]], deadline: float) -> List[str]:
+        """Run a reply's tool calls concurrently; each result is a string for a tool message.
+
+        Calls still running at `deadline` (a time.monotonic() value) are reported
+        to the model as timed out and left to finish in the background.
+        """
+        futures = [self._pool.submit(self._invoke, call["name"], call["arguments"]) for call in calls]
+        results = []
+        for call, future in zip(calls, futures):
+            try:
+                results.append(future.result(timeout=max(0.0, deadline - time.monotonic())))
+            except FutureTimeout:
+                self._count(call["name"], "timeouts")
+                metrics.inc("tool_calls_total", call["name"], "timeout")
+                results.append(f"Error: Tool '{call['name']}' timed out.")
+        return results
+
+    def _invoke(self, name: str, arguments: str) -> str:
+        tool = self._tools.get(name)
+        if tool is None:
+            return f"Error: Unknown tool '{name}'."
+        self._count(name, "calls")
+        try:
+            args = json.loads(arguments or "{}")
+            if not isinstance(args, dict):
+                raise ValueError("Tool arguments must be a JSON object.")
+        except ValueError as e:
+            self._count(name, "errors")
+            metrics.inc("tool_calls_total", name, "error")
+            return f"Error: Invalid arguments for '{name}': {e}"
+
+        key = json.dumps(args, sort_keys=True, separators=(',', ':')) if tool.pure else None
+        if key is not None:
+            with self._lock:
+                if key in tool.cache:
+                    tool.cache.move_to_end(key)
+                    self._stats[name]["cache_hits"] += 1
+                    metrics.inc("tool_calls_total", name, "cached")
+                    return tool.cache[key]
+
+        started = time.perf_counter()
+        try:
+            result = tool.function(**args)
+            result = result if isinstance(result, str) else json.dumps(result)
+        except Exception as e:
+            print(f"[DEBUG] Error in tool '{name}': {e}")
+            self._count(name, "errors")
+            metrics.inc("tool_calls_total", name, "error")
+            return f"Error: {e}"
+        finally:
+            metrics.observe("tool_seconds", time.perf_counter() - started, name)
+        metrics.inc("tool_calls_total", name, "ok")
+
+        if key is not None:
+            with self._lock:
+                tool.cache[key] = result
+                while len(tool.cache) > self.cache_size:
+                    tool.cache.popitem(last=False)
+        return result
+
+    def _count(self, name: str, stat: str):
+        with self._lock:
+            if name in self._stats:
+                self._stats[name][stat] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {name: dict(self._stats[name], pure=tool.pure, cached=len(tool.cache))
+                    for name, tool in self._tools.items()}
+
+def perform_math_operation(operation: str, x: float, y: float) -> float:
+    if operation == "add":
+        return x + y
+    elif operation == "subtract":
+        return x - y
+    elif operation == "multiply":
+        return x * y
+    elif operation == "divide":
+        if y == 0:
+            raise ValueError("Cannot divide by zero.")
+        return x / y
+    raise ValueError(f"Unknown operation: {operation}")
+
+# Tools every context can use once settings.use_tools is on
+registry = ToolRegistry()
+registry.register(
+    "perform_math_operation", perform_math_operation,
+    "Perform a basic math operation on two numbers.",
+    {
+        "type": "object",
+        "properties": {
+            "operation": {"type": "string", "enum": ["add", "subtract", "multiply", "divide"],
+                          "description": "The math operation to perform."},
+            "x": {"type": "number", "description": "The first number."},
+            "y": {"type": "number", "description": "The second number."},
+        },
+        "required": ["operation", "x", "y"],
+    },
+    pure=True,
+)
@@ -0,0 +1,80 @@
+# traffic.py
+
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterator, Optional
+
+class TrafficRecorder:
+    """Appends one compact JSON line per API request to a size-rotated log.
+
+    The log rolls over to <path>.1, <path>.2, ... once it passes `max_bytes`;
+    read_traffic() reads them back oldest first for benchmarks/replay.py.
+    Each worker process should get its own path.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 10 * 1024 * 1024, backups: int = 5):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def record(self, method: str, route: str, body: Any, status: int, duration: float,
+               request_id: Optional[str] = None, arrived: Optional[float] = None):
+        # "t" is when the request arrived (time.time()); without it, when it is recorded
+        entry = {"t": round(arrived if arrived is not None else time.time(), 4), "method": method, "route": route, "status": status,
+                 "ms": round(duration * 1000, 2)}
+        if isinstance(body, dict):
+            context = body.get('context_name') or body.get('name') or body.get('source_name')
+            if context:
+                entry["context"] = context
+        if body is not None:
+            entry["body"] = body
+        if request_id:
+            entry["request_id"] = request_id
+        line = json.dumps(entry, separators=(',', ':')) + "\n"
+        with self._lock:
+            try:
+                self._file.write(line)
+                self._file.flush()
+                if self._file.tell() >= self.max_bytes:
+                    self._rotate()
+            except Exception as e:
+                print(f"[DEBUG] Error writing traffic log: {e}")
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+def read_traffic(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield the records in `path` and its rotated backups, oldest first."""
+    backups = []
+    i = 1
+    while os.path.exists(f"{path}.{i}"):
+        backups.append(f"{path}.{i}")
+        i += 1
+    files = backups[::-1] + ([path] if os.path.exists(path) else [])
+    for name in files:
+        with open(name, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # A worker killed mid-write leaves a truncated last line
+                    print(f"[DEBUG] Skipping malformed traffic record in {name}")